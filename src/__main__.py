@@ -1,4 +1,5 @@
 from argparse import ArgumentParser
+from json import loads
 from logging import (
     DEBUG,
     INFO,
@@ -58,6 +59,14 @@ def initialize() -> Any:
         default="DEBUG",
         choices=["DEBUG", "INFO"],
     )
+    parser.add_argument(
+        "-o",
+        "--options",
+        type=str,
+        help="Solver options as a JSON object",
+        required=False,
+        default="{}",
+    )
     args = parser.parse_args()
     log_level = DEBUG if args.log_level.upper() == "DEBUG" else INFO
 
@@ -77,9 +86,10 @@ def initialize() -> Any:
 def dispatch(args: Any) -> None:
     """Dispatch the use case to the corresponding function."""
     dir_list = lambda name: [f.path for f in scandir(name) if f.is_dir()]
+    options = loads(args.options)
 
     if args.use_case == "optimize":
-        run_optimize(args.method, args.instance_name, args.timeout)
+        run_optimize(args.method, args.instance_name, args.timeout, options)
 
     elif args.use_case == "experiment":
         if args.instance_names == "all":
@@ -96,7 +106,7 @@ def dispatch(args: Any) -> None:
         else:
             instances = args.instance_names.split(",")
 
-        run_experiment(args.method, instances, args.timeout)
+        run_experiment(args.method, instances, args.timeout, options)
 
     elif args.use_case == "describe":
         run_describe()
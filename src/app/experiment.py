@@ -3,7 +3,9 @@ from logging import info
 from services.benchmark import Benchmark
 
 
-def run_experiment(method: str, instance_names: list[str], timeout: int) -> None:
+def run_experiment(
+    method: str, instance_names: list[str], timeout: int, options: dict = {}
+) -> None:
     """
     # Experiment use case.
 
@@ -13,8 +15,9 @@ def run_experiment(method: str, instance_names: list[str], timeout: int) -> None
         instance_names=instance_names,
         method=method,
         timeout=timeout,
+        options=options,
     )
     benchmark.execute()
     info(
-        f"Benchmark | Instances {instance_names} | Method {method} | Timeout {timeout}"
+        f"Benchmark | Instances {instance_names} | Method {method} | Timeout {timeout} | Options {options}"
     )
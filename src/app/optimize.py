@@ -1,10 +1,13 @@
 from domain.BatchPicking import BatchPicking
 
 
-def run_optimize(method: str, instance_name: str, timeout: int) -> None:
+def run_optimize(
+    method: str, instance_name: str, timeout: int, options: dict = {}
+) -> None:
     """
     # Optimization use case.
 
     Execute the optimization process using the given method and instance name.
+    The options are forwarded to the solver of the method (e.g. `{"portfolio": true}`).
     """
-    BatchPicking.optimize(method, instance_name, timeout)
+    BatchPicking.optimize(method, instance_name, timeout, **options)
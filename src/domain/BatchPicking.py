@@ -1,7 +1,7 @@
 from logging import debug, error, info
 
 from domain.joint import Joint
-from domain.models.method import Method
+from domain.models.method import Deadline, Method, Report
 from domain.models.solutions import Solution
 from domain.sequential import Sequential
 from services.io import Reader
@@ -11,6 +11,10 @@ APPROACHES = {
     "sequential": Sequential,
     "joint": Joint,
 }
+DEADLINE_SHARES = {
+    "sequential": {"batching": 0.3, "routing": 0.5, "local_search": 0.2},
+    "joint": {"routing": 1.0},
+}
 
 
 class BatchPicking:
@@ -33,10 +37,12 @@ class BatchPicking:
             raise ValueError(f"Invalid method: {name}")
 
     @classmethod
-    def optimize(cls, method: str, instance_name: str, timeout: int) -> None:
+    def optimize(cls, method: str, instance_name: str, timeout: int, **kwargs) -> None:
         """
         Orchestrates the optimization process.
         This process executes the optimization method and save the best solution found in a maximum number of iterations.
+        The keyword arguments are the options of the optimization method (e.g. the OR-Tools search portfolio).
+        The timeout is a global deadline split across the solve phases of the method.
         """
         has_improved, should_continue, count = False, True, 0
         warehouse = Reader(instance_name=instance_name).load_instance()
@@ -50,12 +56,27 @@ class BatchPicking:
                 if not warehouse.is_valid:
                     raise ValueError("Invalid instance")
 
-                solver = cls.dispatch(method, warehouse=warehouse, timeout=timeout)
-                routes, time = solver.solve()
+                report = Report()
+                deadline = Deadline(
+                    timeout=timeout, shares=DEADLINE_SHARES.get(method.lower(), {})
+                )
+                solver = cls.dispatch(
+                    method,
+                    warehouse=warehouse,
+                    timeout=timeout,
+                    report=report,
+                    deadline=deadline,
+                )
+                routes, time = solver.solve(**kwargs)
+
+                for name, used in deadline.usage.items():
+                    report.record(f"time_{name}", round(used, 2))
+
                 solution = Solution(
                     instance_name=instance_name,
                     warehouse=warehouse,
                     batches=routes,
+                    report=report,
                 )
                 info(
                     f"BatchPicking | Finished in {time} seconds | Method: {method.upper()} | Solution: {str(solution)}"
@@ -1,11 +1,14 @@
-from domain.joint.vrp import VRP, VRPFormulation
-from domain.models.method import Method, measure_consumption
+from domain.joint.decomposition import VRPDecomposition
+from domain.joint.vrp import VRP, VRPCompactFormulation, VRPFormulation
+from domain.models.method import Method, measure_consumption, phase
 from domain.models.solutions import Batch
 
 JOINT_ROUTING_METHOD_DEFAULT = "VRP"
 JOINT_ROUTING_METHODS = {
     "VRP": VRP,
     "VRPFormulation": VRPFormulation,
+    "VRPCompactFormulation": VRPCompactFormulation,
+    "VRPDecomposition": VRPDecomposition,
 }
 
 
@@ -16,6 +19,10 @@ class Joint(Method):
     Our joint approach consists of modeling the Batch-Picking problem as the Multi-depot Vehicle Routing Problem with Mixed Pickup and Delivery (MDVRPMPD).
     Two options are available to solve the joint problem: an heuristic method and a mathematical programming formulation.
     The problem statement and the solution approaches can be found at the [report](https://www.overleaf.com/read/xfgcnzwccnqj#8fe7b9).
+    The OR-Tools method can run a portfolio of search strategies in parallel with the `portfolio` option.
+    The remaining options are passed to the routing method (e.g. `stagnation_window` in seconds and `stagnation_improvement`).
+    For large instances, the `VRPDecomposition` routing method solves the VRP of spatial regions in parallel.
+    The `VRPCompactFormulation` routing method builds a smaller formulation directly with gurobipy.
     """
 
     @measure_consumption
@@ -25,6 +32,10 @@ class Joint(Method):
         if routing_method not in JOINT_ROUTING_METHODS:
             raise ValueError(f"Unknown routing method {routing_method}")
 
-        vrp_model = JOINT_ROUTING_METHODS[routing_method](**self.__dict__)
+        with phase(self.deadline, "routing"):
+            timeout = self.deadline.budget() if self.deadline else self.timeout
+            vrp_model = JOINT_ROUTING_METHODS[routing_method](
+                **{**self.__dict__, "trace": True, **kwargs, "timeout": timeout}
+            )
 
-        return vrp_model.solve()
+            return vrp_model.solve(**kwargs)
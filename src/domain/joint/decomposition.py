@@ -0,0 +1,193 @@
+from concurrent.futures import ProcessPoolExecutor
+from logging import info
+from os import cpu_count
+
+import numpy as np
+
+from domain.joint.vrp import ORTOOLS_FIELDS, VRP
+from domain.models.instances import Order
+from domain.models.solutions import Batch
+
+REGION_MAX_BATCHES = 10
+BOUNDARY_SHARE = 0.2  # share of the time limit for the boundary re-optimization
+BOUNDARY_BATCHES = 3  # batches of each region involved in a boundary re-optimization
+
+
+def route_region(data: dict, orders: list[Order], solution: list[Batch]) -> list[Batch]:
+    """Solve the VRP of a subset of orders (run in a separate process), optionally warm-started from a solution."""
+    warehouse = data["warehouse"].copy(
+        update={
+            "orders": orders,
+            "current_solution": [
+                [item for item in batch.route.sequence if item.is_pickup]
+                for batch in solution
+            ],
+        }
+    )
+    vrp = VRP(**{**data, "warehouse": warehouse, "trace": False})
+
+    return vrp.route()
+
+
+class VRPDecomposition(VRP):
+    """
+    # Cluster-first decomposition of the VRP
+
+    The orders are partitioned into spatial regions by recursive bisection of the order centroids,
+    until the capacity lower bound of each region is at most `REGION_MAX_BATCHES` batches.
+    The VRP of each region is solved independently in parallel processes.
+    Then, the boundary between neighboring regions is re-optimized by solving the VRP of their closest batches together.
+    """
+
+    boundary: bool = True
+
+    def centroid(self, orders: list[Order]) -> np.ndarray:
+        return np.mean(
+            [item.coordinates for od in orders for item in od.pickups], axis=0
+        )
+
+    def nb_batches(self, orders: list[Order]) -> float:
+        """Capacity lower bound of the number of batches to serve the orders."""
+        vehicle = self.warehouse.vehicle
+
+        return max(
+            sum(order.volume for order in orders) / vehicle.max_volume,
+            len(orders) / vehicle.max_nb_orders,
+        )
+
+    def partition(self, orders: list[Order]) -> list[list[Order]]:
+        """Recursive bisection along the widest axis, at the volume-weighted median of the order centroids."""
+        if self.nb_batches(orders) <= REGION_MAX_BATCHES or len(orders) < 2:
+            return [orders]
+
+        centroids = np.array([self.centroid([order]) for order in orders])
+        axis = np.argmax(np.ptp(centroids, axis=0))
+        indices = np.argsort(centroids[:, axis], kind="stable")
+        volumes = np.cumsum([orders[i].volume for i in indices])
+        split = int(np.searchsorted(volumes, volumes[-1] / 2)) + 1
+        split = min(max(split, 1), len(orders) - 1)
+
+        left = [orders[i] for i in indices[:split]]
+        right = [orders[i] for i in indices[split:]]
+
+        return self.partition(left) + self.partition(right)
+
+    def neighbors(self, regions: list[list[Order]]) -> list[tuple[int, int]]:
+        """Pairs of regions where one is the nearest region of the other, based on their centroids."""
+        centroids = np.array([self.centroid(region) for region in regions])
+        distances = np.linalg.norm(centroids[:, None] - centroids[None, :], axis=2)
+        np.fill_diagonal(distances, np.inf)
+        nearest = np.argmin(distances, axis=1)
+
+        return sorted(set(tuple(sorted((i, int(j)))) for i, j in enumerate(nearest)))
+
+    def rounds(self, pairs: list[tuple[int, int]]) -> list[list[tuple[int, int]]]:
+        """Group the pairs of regions in rounds of disjoint pairs, to re-optimize them in parallel."""
+        rounds, pending = [], list(pairs)
+
+        while pending:
+            used, current = set(), []
+
+            for pair in pending:
+                if not used.intersection(pair):
+                    current.append(pair)
+                    used.update(pair)
+
+            pending = [pair for pair in pending if pair not in current]
+            rounds.append(current)
+
+        return rounds
+
+    def boundary_batches(self, batches: list[Batch], other: list[Batch]) -> list[Batch]:
+        """Batches of a region closest to the centroid of the neighboring region."""
+        target = self.centroid([od for batch in other for od in batch.orders])
+        distance = lambda batch: np.linalg.norm(self.centroid(batch.orders) - target)
+
+        return sorted(batches, key=distance)[:BOUNDARY_BATCHES]
+
+    def reoptimize(
+        self, data: dict, solutions: list[list[Batch]], nb_workers: int
+    ) -> list[list[Batch]]:
+        """
+        Re-optimize the boundary batches of neighboring regions, keeping the improving solutions.
+        A region whose batches were all moved to a neighbor in a previous round is skipped.
+        """
+        regions = [
+            [od for batch in batches for od in batch.orders] for batches in solutions
+        ]
+        rounds = self.rounds(self.neighbors(regions))
+        waves = sum(np.ceil(len(pairs) / nb_workers) for pairs in rounds)
+        data = {**data, "timeout": self.timeout * BOUNDARY_SHARE / waves}
+
+        for pairs in rounds:
+            selected = {
+                (i, j): (
+                    self.boundary_batches(solutions[i], solutions[j]),
+                    self.boundary_batches(solutions[j], solutions[i]),
+                )
+                for i, j in pairs
+                if solutions[i] and solutions[j]
+            }
+
+            with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+                futures = {
+                    pair: executor.submit(
+                        route_region,
+                        data,
+                        [od for batch in left + right for od in batch.orders],
+                        left + right,
+                    )
+                    for pair, (left, right) in selected.items()
+                }
+
+                for (i, j), future in futures.items():
+                    left, right = selected[(i, j)]
+                    batches = future.result()
+                    before = self.total_distance(left + right)
+                    after = self.total_distance(batches)
+
+                    if after < before:
+                        info(
+                            f"VRPDecomposition | Boundary {i}-{j} | Improved from {before} to {after}"
+                        )
+                        replaced = set(id(batch) for batch in left + right)
+                        solutions[i] = [
+                            b for b in solutions[i] if id(b) not in replaced
+                        ] + batches
+                        solutions[j] = [
+                            b for b in solutions[j] if id(b) not in replaced
+                        ]
+
+        return solutions
+
+    def solve(self, **kwargs) -> list[Batch]:
+        """Solve the VRP of each region in parallel and merge the batches into one solution."""
+        regions = self.partition(self.warehouse.orders)
+        nb_workers = min(len(regions), cpu_count() or 1)
+        waves = np.ceil(len(regions) / nb_workers)
+        share = 1 - BOUNDARY_SHARE if self.boundary and len(regions) > 1 else 1
+        info(
+            f"VRPDecomposition | Warehouse {self.warehouse.name} | Regions {[len(r) for r in regions]} | Workers {nb_workers}"
+        )
+        self.report.record("nb_regions", len(regions))
+
+        data = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key not in ORTOOLS_FIELDS  # not picklable
+        }
+        data["timeout"] = self.timeout * share / waves
+
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            futures = [
+                executor.submit(route_region, data, region, []) for region in regions
+            ]
+            solutions = [future.result() for future in futures]
+
+        if share < 1:
+            solutions = self.reoptimize(data, solutions, nb_workers)
+
+        batches = [batch for batches in solutions for batch in batches]
+        self.update_current_solution(batches)
+
+        return batches
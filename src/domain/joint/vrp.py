@@ -1,14 +1,107 @@
-from logging import debug, error, info
-from typing import Any
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from logging import debug, error, info, warning
+from os import cpu_count, makedirs, path
+from time import time
+from typing import Any, Optional
 
 import numpy as np
 import pyomo.environ as pyo
+from gurobipy import GRB, Model, quicksum
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+from pydantic import BaseModel, Field
 
 from domain.models.instances import Item, Order
 from domain.models.method import Callbacks
 from domain.models.routing import Routing
 from domain.models.solutions import Batch, Metrics, Route
+from services.io import IO
+
+INITIAL_SOLUTION_STRATEGY = "INITIAL"
+VRP_PORTFOLIO_DEFAULT = [
+    "INITIAL:AUTOMATIC",
+    "INITIAL:GUIDED_LOCAL_SEARCH",
+    "PATH_CHEAPEST_ARC:GUIDED_LOCAL_SEARCH",
+    "SAVINGS:GUIDED_LOCAL_SEARCH",
+    "PARALLEL_CHEAPEST_INSERTION:GUIDED_LOCAL_SEARCH",
+    "LOCAL_CHEAPEST_INSERTION:SIMULATED_ANNEALING",
+    "PARALLEL_CHEAPEST_INSERTION:TABU_SEARCH",
+    "SAVINGS:SIMULATED_ANNEALING",
+]
+ORTOOLS_FIELDS = ["manager", "routing", "parameters", "callbacks", "convergence"]
+STAGNATION_IMPROVEMENT = 0.005  # relative improvement (0.5%)
+STAGNATION_WINDOW = 60  # seconds
+
+
+def route_member(data: dict, member: str) -> tuple[str, list[Batch], dict]:
+    """Solve the VRP with the search strategy of a portfolio member (run in a separate process)."""
+    vrp = VRP(**{**data, **VRP.parse_member(member), "member": member})
+    batches = vrp.route()
+
+    return member, batches, vrp.report.details
+
+
+class Convergence(BaseModel):
+    """
+    # Convergence trace
+
+    Record of the objective value of the solutions found by an OR-Tools search, streamed to a CSV file.
+    The search is stagnated when the objective has not improved by more than a relative `improvement` within `window` seconds.
+    """
+
+    filename: Optional[str] = None
+    improvement: float = STAGNATION_IMPROVEMENT
+    window: Optional[float] = STAGNATION_WINDOW
+    start_time: float = Field(default_factory=time)
+    reference_time: float = Field(default_factory=time)
+    reference: float = np.inf
+    best: float = np.inf
+    nb_solutions: int = 0
+    time_to_first: float = np.nan
+    time_to_best: float = np.nan
+
+    def initialize(self) -> None:
+        self.start_time = self.reference_time = time()
+
+        if self.filename:
+            makedirs(path.dirname(self.filename), exist_ok=True)
+
+            with open(self.filename, "w") as file:
+                file.write("elapsed_time,objective,nb_solutions\n")
+
+    def update(self, objective: float) -> None:
+        """Record a new solution and update the reference of the stagnation rule."""
+        now = time()
+        elapsed = round(now - self.start_time, 3)
+        self.nb_solutions += 1
+
+        if self.nb_solutions == 1:
+            self.time_to_first = elapsed
+
+        if objective < self.best:
+            self.best, self.time_to_best = objective, elapsed
+
+        if objective < self.reference * (1 - self.improvement):
+            self.reference, self.reference_time = objective, now
+
+        if self.filename:
+            with open(self.filename, "a") as file:
+                file.write(f"{elapsed},{objective},{self.nb_solutions}\n")
+
+    def is_stagnated(self) -> bool:
+        """Checked by the solver during the search (not only at new solutions)."""
+        if self.window is None or self.nb_solutions == 0:
+            return False
+
+        return time() - self.reference_time > self.window
+
+    @property
+    def stats(self) -> dict[str, float]:
+        return {
+            "time_to_first_solution": self.time_to_first,
+            "time_to_best_solution": self.time_to_best,
+            "nb_solutions": self.nb_solutions,
+        }
 
 
 class VRP(Routing):
@@ -18,6 +111,14 @@ class VRP(Routing):
     routing: Any = None
     parameters: Any = None
     callbacks: Callbacks = Callbacks()
+    first_solution_strategy: str = "PATH_CHEAPEST_ARC"
+    local_search_metaheuristic: str = "AUTOMATIC"
+    warm_start: bool = True
+    member: str = ""
+    trace: bool = False
+    stagnation_improvement: float = STAGNATION_IMPROVEMENT
+    stagnation_window: Optional[float] = STAGNATION_WINDOW
+    convergence: Convergence = Convergence()
 
     @property
     def demands(self) -> list[int]:
@@ -92,15 +193,22 @@ class VRP(Routing):
         [Reference](https://developers.google.com/optimization/routing/routing_options)
         """
         self.parameters = pywrapcp.DefaultRoutingSearchParameters()
-        self.parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        self.parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, self.first_solution_strategy
         )
-        self.parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.AUTOMATIC
+        self.parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic,
+            self.local_search_metaheuristic,
         )
-        self.parameters.time_limit.FromSeconds(self.timeout)
         self.parameters.log_search = self.verbose
-        self.parameters.solution_limit = 500
+
+        if self.timeout > 0:
+            self.parameters.time_limit.FromMilliseconds(int(self.timeout * 1000))
+            self.parameters.solution_limit = 500
+        else:
+            # Budget exhausted: keep the first solution
+            self.parameters.solution_limit = 1
+
         self.routing.CloseModelWithParameters(self.parameters)
 
     def get_initial_solution(self) -> Any:
@@ -117,13 +225,27 @@ class VRP(Routing):
         else:
             solution = self.warehouse.base_solution
 
+        # Each route must also visit the dummy (delivery) node of its orders
+        dummies = {
+            self.node_to_order[node.id]: idx
+            for idx, node in self.node_items
+            if node.is_dummy
+        }
         grouped_nodes = [
-            [self.get_node_idx(item) for item in batch] for batch in solution
+            [self.get_node_idx(item) for item in batch]
+            + [
+                dummies[order_id]
+                for order_id in sorted(set(self.node_to_order[i.id] for i in batch))
+            ]
+            for batch in solution
         ]
 
         initial_solution = self.routing.ReadAssignmentFromRoutes(grouped_nodes, True)
         debug(f"VRP | Initial solution | Node indices {grouped_nodes}")
 
+        if initial_solution is None:
+            warning(f"VRP | Initial solution is not feasible | Ignored")
+
         return initial_solution
 
     def update_current_solution(self, batches: list[Batch]) -> None:
@@ -146,7 +268,7 @@ class VRP(Routing):
         demands, volumes = self.demands, self.volumes
         is_unique = lambda item, sequence: item not in sequence and not item.is_dummy
 
-        for vehicle_id in range(self.nb_vehicles):
+        for vehicle_id in range(self.routing.vehicles()):
             index = self.routing.Start(vehicle_id)
             sequence = []
             distance, unit_load, volume_load = 0, 0, 0
@@ -291,6 +413,45 @@ class VRP(Routing):
 
         debug(f"Pickup and delivery constraints | Items: {grouped_items}")
 
+    # Convergence
+    # -----------
+
+    def trace_filename(self) -> Optional[str]:
+        """Trace file at the outputs folder of the instance (one per portfolio member)."""
+        if not self.trace:
+            return None
+
+        suffix = f"_{self.member.replace(':', '_').lower()}" if self.member else ""
+
+        return path.join(
+            IO().directory,
+            "outputs",
+            self.warehouse.instance_name,
+            f"convergence{suffix}.csv",
+        )
+
+    def track_convergence(self) -> None:
+        """
+        Trace the objective of each solution found and stop the search when it stagnates.
+        The solution callback streams the trace, whereas the custom limit is checked periodically by the solver.
+        """
+        self.convergence = Convergence(
+            filename=self.trace_filename(),
+            improvement=self.stagnation_improvement,
+            window=self.stagnation_window,
+        )
+        self.convergence.initialize()
+
+        def solution_callback():
+            self.convergence.update(self.routing.CostVar().Max())
+
+        self.callbacks.solution = solution_callback
+        self.callbacks.limit = self.routing.solver().CustomLimit(
+            self.convergence.is_stagnated
+        )
+        self.routing.AddAtSolutionCallback(self.callbacks.solution)
+        self.routing.AddSearchMonitor(self.callbacks.limit)
+
     # Model
     # -----
 
@@ -324,13 +485,18 @@ class VRP(Routing):
         Returns a list of batches, each one with a route and the orders to be picked.
         """
         self.build_model()
+        self.track_convergence()
         self.set_parameters()
         info(
             f"VRP | Warehouse {self.warehouse.name} | Vehicles {self.nb_vehicles} | Nodes {len(self.graph)}"
         )
 
-        if self.is_warehouse_complete:
+        initial_solution = None
+
+        if self.is_warehouse_complete and self.warm_start:
             initial_solution = self.get_initial_solution()
+
+        if initial_solution is not None:
             solution = self.routing.SolveFromAssignmentWithParameters(
                 initial_solution, self.parameters
             )
@@ -338,9 +504,13 @@ class VRP(Routing):
         else:
             solution = self.routing.SolveWithParameters(self.parameters)
 
+        if self.trace:
+            for key, value in self.convergence.stats.items():
+                self.report.record(key, value)
+
         if solution and self.is_valid:
             info(
-                f"VRP | Warehouse {self.warehouse.name} | Solution obtained | Status: {self.status}"
+                f"VRP | Warehouse {self.warehouse.name} | Solution obtained | Status: {self.status} | Convergence: {self.convergence.stats}"
             )
 
             return self.build_solution(solution)
@@ -350,8 +520,101 @@ class VRP(Routing):
                 f"VRP | Warehouse {self.warehouse.name} | No solution found"
             )
 
+    @staticmethod
+    def parse_member(member: str) -> dict[str, Any]:
+        """
+        Parse a portfolio member of the form `FIRST_SOLUTION_STRATEGY:LOCAL_SEARCH_METAHEURISTIC`.
+        The `INITIAL` first solution strategy warm-starts the search from the current (or S-shaped) solution.
+        """
+        strategy, metaheuristic = member.upper().split(":")
+        is_initial = strategy == INITIAL_SOLUTION_STRATEGY
+
+        if not is_initial and not hasattr(
+            routing_enums_pb2.FirstSolutionStrategy, strategy
+        ):
+            raise ValueError(f"Unknown first solution strategy {strategy}")
+
+        if not hasattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic):
+            raise ValueError(f"Unknown local search metaheuristic {metaheuristic}")
+
+        return {
+            "first_solution_strategy": "AUTOMATIC" if is_initial else strategy,
+            "local_search_metaheuristic": metaheuristic,
+            "warm_start": is_initial,
+        }
+
+    def solve_portfolio(self, portfolio: list[str]) -> list[Batch]:
+        """
+        Run a portfolio of search strategies in parallel processes under the same time limit and keep the best solution.
+        Each member builds its own model, since the OR-Tools objects cannot be shared between processes.
+        """
+        nb_workers = min(len(portfolio), cpu_count() or 1)
+
+        if nb_workers < len(portfolio):
+            warning(
+                f"VRP | Portfolio | {len(portfolio)} members for {nb_workers} cores | Keeping the first {nb_workers}"
+            )
+            portfolio = portfolio[:nb_workers]
+
+        for member in portfolio:
+            self.parse_member(member)  # fail fast on invalid members
+
+        data = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key not in ORTOOLS_FIELDS  # not picklable
+        }
+        results, reports = {}, {}
+
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            futures = [
+                executor.submit(route_member, data, member) for member in portfolio
+            ]
+
+            for future in futures:
+                try:
+                    member, batches, details = future.result()
+                    results[member] = batches
+                    reports[member] = details
+                    info(
+                        f"VRP | Portfolio | Member {member} | Distance {self.total_distance(batches)}"
+                    )
+
+                except Exception as err:
+                    error(f"VRP | Portfolio | Member failed: {err}")
+
+        if not results:
+            raise ValueError(
+                f"VRP | Warehouse {self.warehouse.name} | No solution found by the portfolio"
+            )
+
+        winner = min(results, key=lambda member: self.total_distance(results[member]))
+        info(f"VRP | Portfolio | Winner {winner}")
+        self.report.record("portfolio_member", winner)
+
+        for key, value in reports[winner].items():
+            self.report.record(key, value)
+
+        self.update_current_solution(results[winner])
+
+        return results[winner]
+
+    def total_distance(self, batches: list[Batch]) -> float:
+        return sum(batch.metrics.distance for batch in batches)
+
     def solve(self, **kwargs) -> list[Batch]:
-        """Solve an instance of the VRP."""
+        """
+        Solve an instance of the VRP.
+        If a portfolio is given (`True` for the default one), several search strategies are run in parallel.
+        """
+        portfolio = kwargs.get("portfolio", [])
+
+        if portfolio is True:
+            portfolio = VRP_PORTFOLIO_DEFAULT
+
+        if portfolio:
+            return self.solve_portfolio(portfolio)
+
         return self.route()
 
     def route_batch(self, batch: Batch) -> Batch:
@@ -586,16 +849,15 @@ class VRPFormulation(Routing):
 
         return batches
 
-    def solve(self) -> list[Batch]:
+    def solve(self, **kwargs) -> list[Batch]:
         """
         Main method to solve the VRP.
         Returns a list of batches, each one with a route and the orders to be picked.
         """
-        model = self.build_model()
-        solver = pyo.SolverFactory("gurobi")
-        result = solver.solve(
-            model, tee=self.verbose, options={"TimeLimit": self.timeout}
-        )
+        with self.report.timer("time_model_build"):
+            model = self.build_model()
+
+        result = self.optimize(model)
 
         if self.is_valid(result):
             return self.build_solution(model)
@@ -604,3 +866,184 @@ class VRPFormulation(Routing):
             raise ValueError(
                 f"VRP | Warehouse {self.warehouse.name} | No solution found"
             )
+
+
+class VRPCompactFormulation(Routing):
+    """
+    Compact gurobipy implementation of the Vehicle Routing Problem (VRP).
+
+    In contrast to `VRPFormulation`, the model is built directly with gurobipy and the dummy (delivery) nodes are skipped:
+    the orders are assigned to the pickers with aggregated load constraints, and the arcs are only defined between the depots
+    and the pick-up nodes that can be served by the same picker. The subtours are eliminated with MTZ constraints on the
+    (picker-independent) visit order, which requires N² constraints instead of N²K.
+    Since the pickers are identical, the symmetries are broken by assigning each order to a picker with a lower or equal index,
+    and by using the pickers in increasing index order.
+    """
+
+    model: Any = None
+    x: Any = None
+    z: Any = None
+
+    @property
+    def pickups(self) -> list[int]:
+        """Return the indices of the pick-up nodes."""
+        return [i for i, node in self.node_items if node.is_pickup]
+
+    def arc_cost(self, i: int, j: int) -> int:
+        return self.warehouse.distance(self.graph[i], self.graph[j])
+
+    def build_model(self) -> Model:
+        """Build the mathematical model for the VRP using gurobipy."""
+        self.build_graph()
+        orders = self.warehouse.orders
+        vehicle = self.warehouse.vehicle
+        order_idx = {order.id: idx for idx, order in enumerate(orders)}
+        pickups = self.pickups
+        node_order = {
+            i: order_idx[self.node_to_order[self.graph[i].id]] for i in pickups
+        }
+        start, end = self.start_node_idx, self.end_node_idx
+        pickers = list(range(len(orders)))
+        big_m = len(pickups)
+
+        # Arcs between the nodes that can be served by the same picker (order index >= picker index)
+        arcs = []
+        for k in pickers:
+            nodes = [i for i in pickups if node_order[i] >= k]
+            arcs.extend(
+                (i, j, k) for i in [start] + nodes for j in nodes + [end] if i != j
+            )
+
+        model = Model()
+        model.Params.OutputFlag = int(self.verbose)
+
+        for name, value in self.time_limits.items():
+            model.setParam(name, value)
+
+        # Variables
+        costs = {(i, j, k): self.arc_cost(i, j) for i, j, k in arcs}
+        x = model.addVars(arcs, vtype=GRB.BINARY, obj=costs, name="x")
+        y = model.addVars(
+            [(o, k) for o in range(len(orders)) for k in range(o + 1)],
+            vtype=GRB.BINARY,
+            name="y",
+        )
+        z = model.addVars(pickers, vtype=GRB.BINARY, name="z")
+        u = model.addVars(pickups, lb=1, ub=big_m, name="u")
+        model.ModelSense = GRB.MINIMIZE
+
+        outgoing, incoming, between = (defaultdict(list) for _ in range(3))
+        for i, j, k in arcs:
+            outgoing[i, k].append(x[i, j, k])
+            incoming[j, k].append(x[i, j, k])
+
+            if i != start and j != end:
+                between[i, j].append(x[i, j, k])
+
+        # Constraints
+        model.addConstrs(
+            (y.sum(o, "*") == 1 for o in range(len(orders))), name="assignment"
+        )
+        model.addConstrs(
+            (
+                quicksum(orders[o].volume * y[o, k] for o in range(k, len(orders)))
+                <= vehicle.max_volume * z[k]
+                for k in pickers
+            ),
+            name="volume_capacity",
+        )
+        model.addConstrs(
+            (y.sum("*", k) <= vehicle.max_nb_orders * z[k] for k in pickers),
+            name="unit_capacity",
+        )
+        model.addConstrs(
+            (
+                quicksum(outgoing[i, k]) == y[node_order[i], k]
+                for i in pickups
+                for k in range(node_order[i] + 1)
+            ),
+            name="leave_pickup",
+        )
+        model.addConstrs(
+            (
+                quicksum(incoming[i, k]) == y[node_order[i], k]
+                for i in pickups
+                for k in range(node_order[i] + 1)
+            ),
+            name="enter_pickup",
+        )
+        model.addConstrs(
+            (quicksum(outgoing[start, k]) == z[k] for k in pickers), name="start"
+        )
+        model.addConstrs(
+            (quicksum(incoming[end, k]) == z[k] for k in pickers), name="end"
+        )
+        model.addConstrs(
+            (
+                u[i] - u[j] + big_m * quicksum(variables) <= big_m - 1
+                for (i, j), variables in between.items()
+            ),
+            name="subtour_elimination",
+        )
+        model.addConstrs((z[k] >= z[k + 1] for k in pickers[:-1]), name="symmetry")
+        model.update()  # process the pending additions, so that the model size is reported
+
+        self.model, self.x, self.z = model, x, z
+
+        return model
+
+    def build_solution(self) -> list[Batch]:
+        """Build a list of batches by following the selected arcs of each picker from the start depot."""
+        batches = []
+        start, end = self.start_node_idx, self.end_node_idx
+        successors = defaultdict(dict)
+
+        for (i, j, k), variable in self.x.items():
+            if variable.X > 0.5:
+                successors[k][i] = j
+
+        for k, successor in successors.items():
+            sequence, distance, node = [self.graph[start]], 0, start
+
+            while node != end:
+                distance += self.arc_cost(node, successor[node])
+                node = successor[node]
+                sequence.append(self.graph[node])
+
+            route = Route(sequence=sequence)
+            orders = list(
+                set(self.get_order(node) for node in route.sequence if node.is_pickup)
+            )
+            if not orders:
+                continue
+
+            metrics = Metrics(
+                distance=distance,
+                units=len(orders),
+                volume=sum(order.volume for order in orders),
+            )
+            batches.append(Batch(orders=orders, route=route, metrics=metrics))
+
+        return batches
+
+    def solve(self, **kwargs) -> list[Batch]:
+        """
+        Main method to solve the VRP.
+        Returns a list of batches, each one with a route and the orders to be picked.
+        """
+        with self.report.timer("time_model_build"):
+            model = self.build_model()
+
+        info(
+            f"VRP | Warehouse {self.warehouse.name} | Compact model | Variables {model.NumVars} | Constraints {model.NumConstrs}"
+        )
+        with self.report.timer("time_solver"):
+            model.optimize()
+
+        if model.SolCount > 0:
+            return self.build_solution()
+
+        else:
+            raise ValueError(
+                f"VRP | Warehouse {self.warehouse.name} | No solution found"
+            )
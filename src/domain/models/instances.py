@@ -1,5 +1,5 @@
 from logging import warning
-from typing import Any
+from typing import Any, Optional
 
 import numpy as np
 from pydantic import BaseModel, validator
@@ -84,6 +84,31 @@ class Distances(BaseModel):
         return value
 
 
+class Aisles(BaseModel):
+    """
+    Aisle subdivision of the warehouse, indexed by position id.
+    The aisles are assumed to be parallel to the y axis, and connected by a front (lowest y) and a back (highest y) cross aisle.
+    """
+
+    aisle: np.ndarray  # aisle of each position (-1 if the position is not in an aisle)
+    x: np.ndarray  # coordinates of each position
+    y: np.ndarray
+    center: np.ndarray  # x coordinate of each aisle
+    front: np.ndarray  # y coordinate of the front end of each aisle
+    back: np.ndarray  # y coordinate of the back end of each aisle
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def nb_aisles(self) -> int:
+        return len(self.center)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.back - self.front
+
+
 class Order(BaseModel):
     """Set of items to be picked up together in a support (physical box)."""
 
@@ -223,6 +248,7 @@ class Warehouse(Instance):
     instance_name: str
     distances: Distances
     vehicle: Vehicle
+    aisles: Optional[Aisles] = None
     current_solution: list[list[Item]] = []
 
     @property
@@ -1,10 +1,11 @@
+from contextlib import contextmanager
 from functools import wraps
 from logging import info
 from time import time
-from typing import Any
+from typing import Any, Optional
 
 from memory_profiler import memory_usage
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from domain.models.instances import Warehouse
 
@@ -33,9 +34,115 @@ def measure_consumption(func: Any) -> Any:
     return wrapper
 
 
+class Report(BaseModel):
+    """
+    Details of the optimization process to be saved along with the solution stats.
+    The same report is shared (not copied) by all the problems involved in a method.
+    """
+
+    details: dict[str, Any] = {}
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def record(self, key: str, value: Any) -> None:
+        self.details[key] = value
+
+    def accumulate(self, key: str, value: float) -> None:
+        self.details[key] = self.details.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, key: str):
+        """Accumulate the time spent in a block of code."""
+        start = time()
+
+        try:
+            yield
+
+        finally:
+            self.accumulate(key, round(time() - start, 3))
+
+
+class Deadline(BaseModel):
+    """
+    Global wall-clock budget of the optimization process, split across the solve phases.
+    When a phase starts, it is allotted its share of the remaining time among the phases not started yet,
+    so that the time unused by a phase is passed on to the next ones.
+    The same deadline is shared (not copied) by all the problems involved in a method.
+    """
+
+    timeout: float
+    shares: dict[str, float]
+    start_time: float = Field(default_factory=time)
+    allotted: dict[str, float] = {}
+    started: dict[str, float] = {}
+    usage: dict[str, float] = {}
+    current: Optional[str] = None
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    @property
+    def remaining(self) -> float:
+        return max(self.timeout - (time() - self.start_time), 0)
+
+    def start(self, phase: str) -> None:
+        pending = [name for name in self.shares if name not in self.allotted]
+        total_share = sum(self.shares[name] for name in pending)
+        share = self.shares.get(phase, 0) / total_share if total_share else 1
+
+        self.allotted[phase] = self.remaining * share
+        self.started[phase] = time()
+        self.current = phase
+        info(f"Deadline | Phase {phase} | Allotted (sec) {self.allotted[phase]:.2f}")
+
+    def stop(self, phase: str) -> None:
+        used = time() - self.started.pop(phase)
+        self.usage[phase] = self.usage.get(phase, 0) + used
+        self.current = None
+        info(
+            f"Deadline | Phase {phase} | Used (sec) {used:.2f} of {self.allotted[phase]:.2f}"
+        )
+
+    def budget(self, phase: Optional[str] = None) -> float:
+        """Remaining time of the phase (the current one by default), bounded by the global remaining time."""
+        phase = phase or self.current
+
+        if phase not in self.started:
+            return self.remaining
+
+        elapsed = time() - self.started[phase]
+
+        return max(min(self.allotted[phase] - elapsed, self.remaining), 0)
+
+    def share(self, weight: float, total_weight: float) -> float:
+        """Fraction of the remaining time of the current phase, zero once the phase is expired."""
+        return self.budget() * weight / total_weight if total_weight else 0
+
+    def is_expired(self, phase: Optional[str] = None) -> bool:
+        return self.budget(phase) <= 0
+
+
+@contextmanager
+def phase(deadline: Optional[Deadline], name: str):
+    """Time a solve phase against the global deadline, if any."""
+    if deadline is None:
+        yield
+        return
+
+    deadline.start(name)
+
+    try:
+        yield
+    finally:
+        deadline.stop(name)
+
+
 class Method(BaseModel):
     warehouse: Warehouse
     timeout: int = 100  # seconds
+    report: Report = Report()
+    deadline: Optional[Deadline] = None
 
     @measure_consumption
     def solve(self):
@@ -46,3 +153,5 @@ class Callbacks(BaseModel):
     distance: Any = None
     demand: Any = None
     volume: Any = None
+    solution: Any = None
+    limit: Any = None
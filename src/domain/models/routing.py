@@ -59,7 +59,10 @@ class Routing(Problem):
 
     @property
     def artificial_idx(self) -> int:
-        return self.warehouse.nb_positions + 1
+        """First id of the dummy nodes, after the ids of all the items (also valid for a subset of orders)."""
+        item_ids = [item.id for order in self.warehouse.orders for item in order.items]
+
+        return max(item_ids) + 1
 
     @property
     def node_items(self) -> list[tuple[int, Item]]:
@@ -139,11 +142,17 @@ class Routing(Problem):
         return routes
 
     def solve_sequential(self, batches: list[Batch]) -> list[Batch]:
-        """Solve multiple TSP instances sequentially."""
+        """
+        Solve multiple TSP instances sequentially.
+        Each batch is given a share of the remaining time of the current phase weighted by its number of items.
+        """
         routes = []
+        pending_items = sum(batch.nb_items for batch in batches)
 
         for batch in batches:
+            self.timeout = self.phase_timeout(batch.nb_items, pending_items)
             routes.append(self.route_batch(batch=batch))
+            pending_items -= batch.nb_items
 
         return routes
 
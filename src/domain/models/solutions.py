@@ -1,33 +1,130 @@
 from logging import error, info
 from os import makedirs, path
-from typing import Any
+from typing import Any, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pyomo.environ as pyo
 from pandas import DataFrame, concat, read_csv, to_datetime
 from pydantic import BaseModel
-
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+
+from services.cache import MatrixCache
+from services.distances import (
+    CLOSENESS_METRIC_DEFAULT,
+    CLOSENESS_METRICS,
+    nearest_pairs,
+)
+from services.estimators import (
+    ROUTE_ESTIMATOR_DEFAULT,
+    ROUTE_ESTIMATOR_FALLBACK,
+    ROUTE_ESTIMATORS,
+    RouteEstimator,
+)
 from services.io import IO
 from services.scripts.solution_checker import evaluate
 
 from .instances import Instance, Item, Vehicle, Warehouse
+from .method import Deadline, Report
 
 DEFAULT_METRICS = {
     "total_distance": 0,
 }
 DEFAULT_TIMEOUT = 2 * 60  # 2 minutes
+DEFAULT_NB_NEIGHBORS = 20
+# Persistent solver: in-process, instead of the LP file round trip of "gurobi"
+DEFAULT_SOLVER = "gurobi_persistent"
 
 
 class Problem(BaseModel):
     warehouse: Warehouse
-    timeout: int = DEFAULT_TIMEOUT
+    timeout: float = DEFAULT_TIMEOUT
     verbose: bool = False
+    report: Report = Report()
+    deadline: Optional[Deadline] = None
+    closeness: Optional[np.ndarray] = None
+    closeness_metric: str = CLOSENESS_METRIC_DEFAULT
+    nb_neighbors: int = DEFAULT_NB_NEIGHBORS
+    solver: str = DEFAULT_SOLVER
+    route_estimator: str = ROUTE_ESTIMATOR_DEFAULT
+    nb_batches: Optional[int] = None
+
+    class Config:
+        arbitrary_types_allowed = True
 
     @property
     def minimum_batches(self) -> int:
+        """Number of batches of the batching models, `nb_batches` if given or the capacity-based default of the warehouse."""
+        if self.nb_batches is not None:
+            return self.nb_batches
+
         return self.warehouse.minimum_batches
 
+    def phase_timeout(self, weight: float = 1, total_weight: float = 1) -> float:
+        """Time limit of a sub-problem, as a weighted share of the current phase of the deadline (if any)."""
+        if self.deadline is None:
+            return self.timeout
+
+        return self.deadline.share(weight, total_weight)
+
+    @property
+    def time_limits(self) -> dict[str, float]:
+        """Limits of a solver run: the time limit, or only the first feasible solution once the time budget is exhausted."""
+        if self.timeout > 0:
+            return {"TimeLimit": self.timeout}
+
+        return {"SolutionLimit": 1}
+
+    def get_metric(self) -> type:
+        """Class of the closeness metric, if it is known and applicable to the warehouse."""
+        if self.closeness_metric not in CLOSENESS_METRICS:
+            raise ValueError(f"Unknown closeness metric {self.closeness_metric}")
+
+        if self.closeness_metric == "AisleJaccard" and self.warehouse.aisles is None:
+            raise ValueError(
+                "The AisleJaccard closeness metric requires the aisle subdivision of the warehouse"
+            )
+
+        return CLOSENESS_METRICS[self.closeness_metric]
+
+    def get_closeness(self) -> np.ndarray:
+        """Distance matrix between the orders, computed once (or loaded from the on-disk cache) and shared by the sub-problems."""
+        if self.closeness is None:
+            metric = self.get_metric()
+            cache = MatrixCache()
+            key = cache.fingerprint(self.warehouse, self.closeness_metric)
+            self.closeness = cache.load(key)
+
+            if self.closeness is None:
+                self.closeness = metric().build_matrix(self.warehouse)
+                cache.save(key, self.closeness)
+
+        return self.closeness
+
+    def get_candidates(self) -> list[tuple[int, int]]:
+        """
+        Pairs of orders (i < j) that can be assigned to the same batch, i.e. nearest neighbors of each other.
+        At least as many neighbors as the capacity of a batch are considered, so that full batches can be formed.
+        The closeness metrics with their own notion of neighbors (e.g. the Jaccard metrics) select the pairs themselves.
+        """
+        nb_neighbors = max(self.nb_neighbors, self.warehouse.vehicle.max_nb_orders)
+        metric = self.get_metric()
+
+        if hasattr(metric, "nearest_pairs"):
+            return metric().nearest_pairs(self.warehouse, nb_neighbors)
+
+        return nearest_pairs(self.warehouse, nb_neighbors)
+
+    def get_estimator(self) -> RouteEstimator:
+        """Route length estimator, based on the aisle subdivision of the warehouse if it is available."""
+        if self.route_estimator not in ROUTE_ESTIMATORS:
+            raise ValueError(f"Unknown route estimator {self.route_estimator}")
+
+        if self.warehouse.aisles is None:
+            return ROUTE_ESTIMATORS[ROUTE_ESTIMATOR_FALLBACK](self.warehouse)
+
+        return ROUTE_ESTIMATORS[self.route_estimator](self.warehouse)
+
     def is_valid(self, result: Any) -> bool:
         if result.solver.termination_condition == pyo.TerminationCondition.infeasible:
             error(f"Problem | Infeasible model")
@@ -41,10 +138,43 @@ class Problem(BaseModel):
     def build_model(self, **kwargs):
         raise NotImplementedError
 
+    def optimize(
+        self,
+        model: pyo.ConcreteModel,
+        options: dict = {},
+        warmstart: bool = False,
+        solver: Any = None,
+    ) -> Any:
+        """
+        Solve a pyomo model with the configured solver.
+        A persistent solver loads the model in-process through the solver API, instead of writing an LP file,
+        starting the solver executable and parsing the results back.
+        With `warmstart`, the current values of the variables are passed as a MIP start (if the solver supports it).
+        A solver instance can be given to query it after the solve (e.g. its solution pool).
+        The time to load the model into the solver and to solve it are added to the report.
+        """
+        solver = solver or pyo.SolverFactory(self.solver)
+        options = {**self.time_limits, **options}
+        kwargs = {"tee": self.verbose, "options": options}
+
+        if warmstart and solver.warm_start_capable():
+            kwargs["warmstart"] = True
+
+        if isinstance(solver, PersistentSolver):
+            with self.report.timer("time_solver_load"):
+                solver.set_instance(model)
+
+            with self.report.timer("time_solver"):
+                return solver.solve(**kwargs)
+
+        with self.report.timer("time_solver"):
+            return solver.solve(model, **kwargs)
+
     def solve(self, **kwargs):
-        model = self.build_model(**kwargs)
-        solver = pyo.SolverFactory("gurobi")
-        result = solver.solve(model, tee=self.verbose)
+        with self.report.timer("time_model_build"):
+            model = self.build_model(**kwargs)
+
+        result = self.optimize(model)
 
         if self.is_valid(result):
             return self.build_solution(model)
@@ -142,6 +272,7 @@ class Batch(Instance):
 class Solution(IO):
     warehouse: Warehouse
     batches: list[Batch]
+    report: Report = Report()
 
     def __str__(self) -> str:
         return f"Solution(routes={[str(batch) for batch in self.batches]})"
@@ -176,6 +307,7 @@ class Solution(IO):
             "method": method,
         }
         stats.update(info)
+        stats.update(self.report.details)
 
         return DataFrame(stats, index=[0])
 
@@ -1,7 +1,10 @@
-from domain.models.method import Method, measure_consumption
+from domain.models.method import Method, measure_consumption, phase
 from domain.models.solutions import Batch
 from domain.sequential.construction import Construction
-from domain.sequential.local_search import LocalSearch
+from domain.sequential.local_search import (
+    LOCAL_SEARCH_METHOD_DEFAULT,
+    LOCAL_SEARCH_METHODS,
+)
 
 
 class Sequential(Method):
@@ -13,21 +16,34 @@ class Sequential(Method):
     The local search algorithm is based on the variable neighborhood search, the tabu search, and the simulated annealing strategies.
 
     The routing problem is solved in parallel with the TSP problem. Since it is a CPU-bound problem, the parallelization is done by using the multi-processing technique.
-    Three versions of the batching problem are proposed: `PMedian`, `Clustering`, and `GraphPartitioning`.
+    Eight versions of the batching problem are proposed: `PMedian` (or its Lagrangian relaxation `PMedianLagrangian`), `Clustering`, `GraphPartitioning`, `Savings` (Clarke-Wright heuristic), `SetPartitioning` (column generation), `MultilevelPartition` (multilevel graph partitioning), and `SeedAssignment` (min-cost flow assignment to seed orders).
     Three versions of the TSP are proposed: `TSPBase`, `TSPMultiCommodityFlow`, and `VRP`.
+    The improvement phase is either the `LocalSearch` (default) or the adaptive large neighborhood search `ALNS`, selected by `improvement_method`.
     """
 
     @measure_consumption
     def solve(self, **kwargs) -> list[Batch]:
+        improvement_method = kwargs.pop(
+            "improvement_method", LOCAL_SEARCH_METHOD_DEFAULT
+        )
+
+        if improvement_method not in LOCAL_SEARCH_METHODS:
+            raise ValueError(f"Unknown improvement method {improvement_method}")
+
         construction = Construction(**self.__dict__)
         initial_solution = construction.solve(**kwargs)
         local_search_params = {
             **self.__dict__,
+            **kwargs,
             **{
                 "routing_method": construction.route,
                 "current_solution": initial_solution,
             },
         }
-        improved_solution = LocalSearch(**local_search_params).solve()
+
+        with phase(self.deadline, "local_search"):
+            improved_solution = LOCAL_SEARCH_METHODS[improvement_method](
+                **local_search_params
+            ).solve()
 
         return improved_solution
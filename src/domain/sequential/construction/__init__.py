@@ -1,15 +1,34 @@
-from logging import info
+from concurrent.futures import ProcessPoolExecutor
+from logging import error, info
+from os import cpu_count
+
+import numpy as np
 
 from domain.joint.vrp import VRP
+from domain.models.method import Deadline, Report, phase
 from domain.models.solutions import Batch, Problem
-from domain.sequential.construction.batching import Clustering, GraphPartition, PMedian
+from domain.sequential.construction.assignment import SeedAssignment
+from domain.sequential.construction.batching import (
+    Clustering,
+    GraphPartition,
+    PMedian,
+    Savings,
+)
+from domain.sequential.construction.lagrangian import PMedianLagrangian
+from domain.sequential.construction.multilevel import MultilevelPartition
+from domain.sequential.construction.set_partitioning import SetPartitioning
 from domain.sequential.construction.tsp import TSPBase, TSPMultiCommodityFlow
 
 CONSTRUCTION_BATCHING_METHOD_DEFAULT = "PMedian"
 CONSTRUCTION_BATCHING_METHODS = {
     "PMedian": PMedian,
+    "PMedianLagrangian": PMedianLagrangian,
     "GraphPartition": GraphPartition,
     "Clustering": Clustering,
+    "Savings": Savings,
+    "SetPartitioning": SetPartitioning,
+    "MultilevelPartition": MultilevelPartition,
+    "SeedAssignment": SeedAssignment,
 }
 CONSTRUCTION_ROUTING_METHOD_DEFAULT = "VRP"
 CONSTRUCTION_ROUTING_METHODS = {
@@ -18,6 +37,39 @@ CONSTRUCTION_ROUTING_METHODS = {
     "VRP": VRP,
 }
 CONSTRUCTION_ROUTING_DEFAULT_PARAMS = {"is_warehouse_complete": False}
+# Largest number of batches of the sweep, relative to the capacity lower bound
+SWEEP_MAX_FACTOR = 1.5
+# Batching methods that depend on the number of batches, the only ones with a sweep
+SWEEP_BATCHING_METHODS = [
+    "PMedian",
+    "PMedianLagrangian",
+    "GraphPartition",
+    "Clustering",
+    "SeedAssignment",
+]
+
+
+def sweep_candidate(
+    data: dict, kwargs: dict, best_distance: float
+) -> tuple[list[Batch], dict]:
+    """
+    Batch and route the orders with a given number of batches (run in a separate process).
+    No routes are returned if the distance lower bound of the batching exceeds the best distance.
+    """
+    construction = Construction(**data)
+    routes = construction.solve(**kwargs, best_distance=best_distance)
+
+    return routes, construction.report.details
+
+
+def pool_candidate(
+    data: dict, routing_method: str, batches: list[Batch]
+) -> list[Batch]:
+    """Route a batching of the solution pool (run in a separate process)."""
+    construction = Construction(**data)
+
+    with phase(construction.deadline, "routing"):
+        return construction.route(routing_method, batches)
 
 
 class Construction(Problem):
@@ -27,15 +79,20 @@ class Construction(Problem):
     The construction heuristic is a sequential approach that given the batches are formed, the routing problem is solved independently as a TSP for each batch.
     The main motivation for this approach is to employ a distance metric that does not require to enumerate all the possible routes to measure the convenience of grouping orders into batches.
     The Hausdorff distance is employed to measure the geographical closeness between each pair of orders.
+    It is computed once on the walking distances of the warehouse and shared by all the batching methods.
     """
 
-    def batch(self, batching_method: str) -> list[Batch]:
+    def batch(self, batching_method: str, **kwargs) -> list[list[Batch]]:
+        """Batching solutions: the solution pool of the model if any (the best first), or its solution."""
         if batching_method not in CONSTRUCTION_BATCHING_METHODS:
             raise ValueError(f"Unknown batching method {batching_method}")
 
-        batching_model = CONSTRUCTION_BATCHING_METHODS[batching_method](**self.__dict__)
+        batching_model = CONSTRUCTION_BATCHING_METHODS[batching_method](
+            **{**self.__dict__, **kwargs, "timeout": self.phase_timeout()}
+        )
+        batches = batching_model.solve()
 
-        return batching_model.solve()
+        return getattr(batching_model, "pool", []) or [batches]
 
     def route(self, routing_method: str, batches: list[Batch]) -> list[Batch]:
         if routing_method not in CONSTRUCTION_ROUTING_METHODS:
@@ -49,15 +106,190 @@ class Construction(Problem):
 
         return routing_model(**data).solve_sequential(batches=batches)
 
+    def candidate_data(self, waves: int, phases: list[str]) -> dict:
+        """
+        Data of a construction run in a separate process, for a share of the current phase (one of `waves` consecutive runs),
+        with its own deadline split across the given phases.
+        """
+        timeout = self.phase_timeout(1, waves)
+        shares = self.deadline.shares if self.deadline else {}
+        deadline = Deadline(
+            timeout=timeout, shares={name: shares.get(name, 1) for name in phases}
+        )
+        data = {key: value for key, value in self.__dict__.items() if key != "report"}
+
+        return {**data, "timeout": timeout, "deadline": deadline}
+
+    def route_pool(self, routing_method: str, pool: list[list[Batch]]) -> list[Batch]:
+        """Route the batchings of a solution pool in parallel processes, and keep the shortest routes."""
+        nb_workers = min(len(pool), cpu_count() or 1)
+        best, best_distance, best_rank = None, np.inf, None
+
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            for start in range(0, len(pool), nb_workers):
+                waves = int(np.ceil((len(pool) - start) / nb_workers))
+                data = self.candidate_data(waves, ["routing"])
+                futures = {
+                    rank: executor.submit(
+                        pool_candidate, data, routing_method, pool[rank]
+                    )
+                    for rank in range(start, min(start + nb_workers, len(pool)))
+                }
+
+                for rank, future in futures.items():
+                    try:
+                        routes = future.result()
+                    except Exception as err:
+                        error(f"Construction | Pool | Solution {rank} failed: {err}")
+                        continue
+
+                    distance = sum(batch.metrics.distance for batch in routes)
+                    info(f"Construction | Pool | Solution {rank} | Distance {distance}")
+
+                    if distance < best_distance:
+                        best, best_distance, best_rank = routes, distance, rank
+
+        if best is None:
+            raise ValueError("Construction | Pool | No solution found")
+
+        self.report.record("pool_size", len(pool))
+        self.report.record("pool_rank", best_rank)
+
+        return best
+
+    def sweep_values(self, nb_values: int) -> list[int]:
+        """Numbers of batches from the capacity lower bound up to `SWEEP_MAX_FACTOR` times it."""
+        warehouse = self.warehouse
+        vehicle = warehouse.vehicle
+        bound = max(
+            warehouse.total_volume / vehicle.max_volume,
+            warehouse.nb_orders / vehicle.max_nb_orders,
+        )
+        values = np.ceil(np.linspace(bound, SWEEP_MAX_FACTOR * bound, nb_values))
+
+        return sorted(set(int(min(max(p, 1), warehouse.nb_orders)) for p in values))
+
+    def distance_lower_bound(self, nb_batches: int) -> float:
+        """
+        Lower bound of the total distance with a given number of batches.
+        The route of an order is at least the detour from the start to the end depot through its farthest item,
+        and each batch is at least the route of one of its orders: the batch of the order with the largest bound,
+        and the other batches at least the smallest bounds of the other orders.
+        """
+        matrix = self.warehouse.distances.matrix
+        start, end = self.warehouse.depot_ids
+        bounds = np.sort(
+            [
+                max(
+                    matrix[start, item.position_id] + matrix[item.position_id, end]
+                    for item in order.pickups
+                )
+                for order in self.warehouse.orders
+            ]
+        )
+
+        return bounds[-1] + bounds[: nb_batches - 1].sum()
+
+    def solve_sweep(self, nb_values: int, **kwargs) -> list[Batch]:
+        """
+        Batch and route the orders for several numbers of batches in parallel processes, and keep the shortest routes.
+        The numbers of batches are solved by increasing value, in waves of one per core.
+        The models may return another number of batches than requested (e.g. at most `p` for `PMedian`),
+        so the distance lower bound is checked on the batches actually returned, and their routing is skipped
+        if it exceeds the best total distance of the previous waves.
+        """
+        pending = self.sweep_values(nb_values)
+        nb_workers = min(len(pending), cpu_count() or 1)
+        best, best_distance, best_details = None, np.inf, {}
+
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            while pending:
+                wave, pending = pending[:nb_workers], pending[nb_workers:]
+                waves = 1 + int(np.ceil(len(pending) / nb_workers))
+                data = self.candidate_data(waves, ["batching", "routing"])
+                futures = {
+                    p: executor.submit(
+                        sweep_candidate,
+                        data,
+                        {**kwargs, "nb_batches": p},
+                        best_distance,
+                    )
+                    for p in wave
+                }
+
+                for p, future in futures.items():
+                    try:
+                        routes, details = future.result()
+                    except Exception as err:
+                        error(f"Construction | Sweep | {p} batches failed: {err}")
+                        continue
+
+                    if not routes:
+                        info(f"Construction | Sweep | {p} batches | Pruned")
+                        continue
+
+                    distance = sum(batch.metrics.distance for batch in routes)
+                    info(f"Construction | Sweep | {p} batches | Distance {distance}")
+
+                    if distance < best_distance:
+                        best, best_distance, best_details = routes, distance, details
+
+        if best is None:
+            raise ValueError("Construction | Sweep | No solution found")
+
+        for key, value in best_details.items():
+            self.report.record(key, value)
+
+        self.report.record("nb_batches", len(best))
+
+        return best
+
     def solve(self, **kwargs) -> list[Batch]:
-        batching_method = kwargs.get("batching_method", "PMedian")
-        batches = self.batch(batching_method)
+        """
+        Batch-first route-second construction, or a sweep over the number of batches (`sweep` values, if more than one).
+        If the batching model returns a solution pool, all its batchings are routed and the shortest routes are kept.
+        With `best_distance`, no routes are returned if the distance lower bound of the batching exceeds it.
+        """
+        nb_values = kwargs.pop("sweep", 0)
+        best_distance = kwargs.pop("best_distance", np.inf)
+        batching_method = kwargs.get(
+            "batching_method", CONSTRUCTION_BATCHING_METHOD_DEFAULT
+        )
+
+        if nb_values > 1:
+            if batching_method not in SWEEP_BATCHING_METHODS:
+                raise ValueError(
+                    f"Sweep not available for batching method {batching_method}, which does not depend on the number of batches"
+                )
+
+            with phase(self.deadline, "batching"):
+                self.get_closeness()  # computed once and sent to the processes
+
+            with phase(self.deadline, "routing"):
+                return self.solve_sweep(nb_values, **kwargs)
+
+        with phase(self.deadline, "batching"):
+            self.get_closeness()
+            pool = self.batch(**{**kwargs, "batching_method": batching_method})
+
         info(
-            f"Construction | Batching {batching_method} | {[str(batch) for batch in batches]}"
+            f"Construction | Batching {batching_method} | {[str(batch) for batch in pool[0]]}"
         )
 
+        bound = min(self.distance_lower_bound(len(batches)) for batches in pool)
+
+        if bound >= best_distance:
+            info(f"Construction | Distance lower bound {bound} | Routing skipped")
+            return []
+
         routing_method = kwargs.get("routing_method", "VRP")
-        routes = self.route(routing_method, batches)
+
+        with phase(self.deadline, "routing"):
+            if len(pool) > 1:
+                routes = self.route_pool(routing_method, pool)
+            else:
+                routes = self.route(routing_method, pool[0])
+
         info(
             f"Construction | Routing {routing_method} | {[str(route) for route in routes]}"
         )
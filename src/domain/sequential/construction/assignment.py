@@ -0,0 +1,177 @@
+from logging import info
+
+import numpy as np
+from ortools.graph.python.min_cost_flow import SimpleMinCostFlow
+
+from domain.models.solutions import Batch, Problem
+
+ASSIGNMENT_CANDIDATES = 10  # nearest seeds of each order in the flow network
+ASSIGNMENT_ITERATIONS = 5
+ASSIGNMENT_COST_SCALE = 100  # the arc costs of the flow network are integers
+ASSIGNMENT_SEED = 0
+
+
+class SeedAssignment(Problem):
+    """
+    # Seed assignment by min-cost flow
+
+    Two-stage batching: first, `p` seed orders are spread with a k-means++ seeding on the closeness matrix.
+    Then, the orders are assigned to the seeds by a min-cost flow (OR-Tools), where each order sends one unit of flow
+    to one of its `ASSIGNMENT_CANDIDATES` nearest seeds, at the cost of their closeness, and each seed takes at most `max_nb_orders` units.
+    The orders that can not reach a seed with spare capacity go through an overflow node at a prohibitive cost.
+    Since the volume is not a flow capacity, the overloaded batches are repaired: their farthest orders (and the overflow ones)
+    are moved to the closest seed with enough capacity, or to a new batch.
+    The seeds are then moved to the medoids of their batches, and the assignment is repeated while the total closeness decreases.
+    """
+
+    def initial_seeds(self) -> np.ndarray:
+        """K-means++ seeding from the medoid of the orders, with a probability proportional to the squared closeness to the nearest seed."""
+        closeness = self.get_closeness()
+        rng = np.random.default_rng(ASSIGNMENT_SEED)
+        seeds = [int(np.argmin(closeness.sum(axis=1)))]
+        distances = closeness[seeds[0]].astype(float) ** 2
+
+        for _ in range(1, min(self.minimum_batches, len(closeness))):
+            total = distances.sum()
+
+            if total == 0:
+                break
+
+            seeds.append(int(rng.choice(len(closeness), p=distances / total)))
+            distances = np.minimum(distances, closeness[seeds[-1]].astype(float) ** 2)
+
+        return np.array(seeds)
+
+    def assign(self, seeds: np.ndarray) -> np.ndarray:
+        """Index of the seed of each order in the min-cost flow, or -1 for the overflow orders."""
+        closeness = self.get_closeness()
+        nb_orders, nb_seeds = len(closeness), len(seeds)
+        nb_candidates = min(ASSIGNMENT_CANDIDATES, nb_seeds)
+        costs = closeness[:, seeds]
+        candidates = np.argpartition(costs, nb_candidates - 1, axis=1)[
+            :, :nb_candidates
+        ]
+        overflow, sink = nb_orders + nb_seeds, nb_orders + nb_seeds + 1
+        overflow_cost = int(ASSIGNMENT_COST_SCALE * (closeness.max() + 1) * nb_orders)
+
+        flow = SimpleMinCostFlow()
+        order_nodes = np.repeat(np.arange(nb_orders), nb_candidates)
+        arcs = flow.add_arcs_with_capacity_and_unit_cost(
+            order_nodes,
+            nb_orders + candidates.ravel(),
+            np.ones(len(order_nodes), dtype=int),
+            np.round(ASSIGNMENT_COST_SCALE * np.take_along_axis(costs, candidates, 1))
+            .astype(int)
+            .ravel(),
+        )
+        flow.add_arcs_with_capacity_and_unit_cost(
+            np.r_[nb_orders + np.arange(nb_seeds), np.arange(nb_orders), overflow],
+            np.r_[np.full(nb_seeds, sink), np.full(nb_orders, overflow), sink],
+            np.r_[
+                np.full(nb_seeds, self.warehouse.vehicle.max_nb_orders),
+                np.ones(nb_orders, dtype=int),
+                nb_orders,
+            ],
+            np.r_[np.zeros(nb_seeds, dtype=int), np.full(nb_orders, overflow_cost), 0],
+        )
+        flow.set_nodes_supplies(
+            np.r_[np.arange(nb_orders), sink],
+            np.r_[np.ones(nb_orders, dtype=int), -nb_orders],
+        )
+
+        if flow.solve() != flow.OPTIMAL:
+            raise ValueError("Seed assignment | Min-cost flow failed")
+
+        labels = np.full(nb_orders, -1)
+        assigned = flow.flows(arcs) > 0
+        labels[order_nodes[assigned]] = candidates.ravel()[assigned]
+
+        return labels
+
+    def repair(
+        self, seeds: np.ndarray, labels: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Move the farthest orders of the overloaded batches (and the overflow orders) to the closest seed with enough capacity."""
+        closeness = self.get_closeness()
+        vehicle = self.warehouse.vehicle
+        volumes = np.array([order.volume for order in self.warehouse.orders])
+        seeds = list(seeds)
+        volume = list(
+            np.bincount(labels[labels >= 0], volumes[labels >= 0], len(seeds))
+        )
+        count = list(np.bincount(labels[labels >= 0], minlength=len(seeds)))
+        pending = list(np.flatnonzero(labels < 0))
+
+        for k in np.flatnonzero(np.array(volume) > vehicle.max_volume):
+            members = np.flatnonzero(labels == k)
+
+            for j in members[np.argsort(-closeness[seeds[k], members], kind="stable")]:
+                if volume[k] <= vehicle.max_volume:
+                    break
+
+                labels[j] = -1
+                volume[k] -= volumes[j]
+                count[k] -= 1
+                pending.append(j)
+
+        for j in sorted(pending, key=lambda j: -volumes[j]):
+            nearest = np.argsort(closeness[j, seeds], kind="stable")
+            k = next(
+                (
+                    k
+                    for k in nearest
+                    if volume[k] + volumes[j] <= vehicle.max_volume
+                    and count[k] < vehicle.max_nb_orders
+                ),
+                len(seeds),
+            )
+
+            if k == len(seeds):
+                seeds.append(j)
+                volume.append(0)
+                count.append(0)
+
+            labels[j] = k
+            volume[k] += volumes[j]
+            count[k] += 1
+
+        return np.array(seeds), labels
+
+    def medoids(self, labels: np.ndarray) -> np.ndarray:
+        closeness = self.get_closeness()
+        medoids = []
+
+        for k in np.unique(labels):
+            members = np.flatnonzero(labels == k)
+            costs = closeness[np.ix_(members, members)].sum(axis=1)
+            medoids.append(members[np.argmin(costs)])
+
+        return np.array(medoids)
+
+    def total_closeness(self, seeds: np.ndarray, labels: np.ndarray) -> float:
+        return self.get_closeness()[seeds[labels], np.arange(len(labels))].sum()
+
+    def solve(self) -> list[Batch]:
+        orders = self.warehouse.orders
+        seeds = self.initial_seeds()
+        best, best_cost = None, np.inf
+
+        for iteration in range(ASSIGNMENT_ITERATIONS):
+            seeds, labels = self.repair(seeds, self.assign(seeds))
+            cost = self.total_closeness(seeds, labels)
+
+            if cost >= best_cost:
+                break
+
+            best, best_cost = labels, cost
+            seeds = self.medoids(labels)
+
+        info(
+            f"Seed assignment | Iterations {iteration + 1} | Closeness {round(best_cost, 2)}"
+        )
+        _, best = np.unique(best, return_inverse=True)
+
+        return [
+            Batch(orders=[orders[i] for i in np.flatnonzero(best == k)])
+            for k in range(best.max() + 1)
+        ]
@@ -1,13 +1,239 @@
+from heapq import heapify, heappop
 from logging import error
+from typing import Any
 
+import numpy as np
 import pyomo.environ as pyo
 from k_means_constrained import KMeansConstrained
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+from scipy.spatial import cKDTree
 
 from domain.models.solutions import Batch, Problem
-from services.distances import Hausdorff
+from services.distances import classical_mds, order_centroids
 
+CLUSTERING_EMBEDDING_DEFAULT = "MDS"
+CLUSTERING_EMBEDDINGS = ["MDS", "Centroids"]
+CLUSTERING_DIMENSIONS = 4  # of the MDS embedding
+CLUSTERING_CANDIDATES = 8  # nearest centers considered when assigning an order
+CLUSTERING_MAX_ITERATIONS = 50
+CLUSTERING_SEED = 0
 
-class PMedian(Problem):
+
+class BatchingModel(Problem):
+    """
+    # Mathematical programming batching model
+
+    The model is warm-started from a greedy batching by closeness, so that the solver has an incumbent from the start
+    (unless the greedy batching has more than `minimum_batches` batches, which the models do not accept),
+    and the greedy batching is returned if the optimization fails or the solution is not a feasible batching.
+    With `pool_size` greater than one, the distinct feasible batchings of the Gurobi solution pool (up to `pool_size`)
+    are kept in `pool`, so that they can be compared by their actual route lengths.
+    """
+
+    pool_size: int = 1
+    pool: list[list[Batch]] = []
+
+    def greedy_solution(self) -> list[Batch]:
+        """
+        The candidate pairs of orders are merged (union-find) by increasing closeness if the capacity of the vehicle allows it.
+        Then, while there are more batches than `minimum_batches`, the smallest batches are filled first-fit with the batches of their closest orders,
+        and finally the smallest batches are dissolved, each order first-fit into the batch of its closest orders,
+        so that the models bounded by `minimum_batches` accept it as a start.
+        """
+        closeness = self.get_closeness()
+        orders = self.warehouse.orders
+        vehicle = self.warehouse.vehicle
+        parent = list(range(len(orders)))
+        volume = [order.volume for order in orders]
+        size = [1] * len(orders)
+        nb_batches = len(orders)
+        minimum_batches = self.minimum_batches
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+
+            return i
+
+        def merge(i: int, j: int) -> bool:
+            root_i, root_j = find(i), find(j)
+
+            if (
+                root_i == root_j
+                or volume[root_i] + volume[root_j] > vehicle.max_volume
+                or size[root_i] + size[root_j] > vehicle.max_nb_orders
+            ):
+                return False
+
+            parent[root_j] = root_i
+            volume[root_i] += volume[root_j]
+            size[root_i] += size[root_j]
+
+            return True
+
+        for i, j in sorted(self.get_candidates(), key=lambda pair: closeness[pair]):
+            nb_batches -= merge(i, j)
+
+        roots = sorted(set(find(i) for i in range(len(orders))), key=size.__getitem__)
+
+        for root in roots:
+            if nb_batches <= minimum_batches:
+                break
+
+            if find(root) != root or size[root] == vehicle.max_nb_orders:
+                continue
+
+            for j in np.argsort(closeness[root], kind="stable"):
+                nb_batches -= merge(root, j)
+
+                if size[root] == vehicle.max_nb_orders or nb_batches <= minimum_batches:
+                    break
+
+        labels = [find(i) for i in range(len(orders))]
+
+        for root in sorted(set(labels), key=size.__getitem__):
+            if nb_batches <= minimum_batches:
+                break
+
+            # Dissolve the batch: each order first-fit into the batch of its closest orders
+            members = [i for i, label in enumerate(labels) if label == root]
+            targets = {}
+
+            for i in members:
+                for j in np.argsort(closeness[i], kind="stable"):
+                    target = labels[j]
+
+                    if (
+                        target != root
+                        and volume[target] + orders[i].volume <= vehicle.max_volume
+                        and size[target] + 1 <= vehicle.max_nb_orders
+                    ):
+                        targets[i] = target
+                        volume[target] += orders[i].volume
+                        size[target] += 1
+                        break
+
+            if len(targets) == len(members):
+                for i, target in targets.items():
+                    labels[i] = target
+
+                nb_batches -= 1
+            else:
+                for i, target in targets.items():
+                    volume[target] -= orders[i].volume
+                    size[target] -= 1
+
+        batches = {}
+
+        for i, order in enumerate(orders):
+            batches.setdefault(labels[i], []).append(order)
+
+        return [Batch(orders=batch) for batch in batches.values()]
+
+    def is_feasible(self, batches: list[Batch]) -> bool:
+        """Each order is in exactly one batch, and each batch respects the capacity of the vehicle."""
+        vehicle = self.warehouse.vehicle
+        ids = sorted(order.id for batch in batches for order in batch.orders)
+
+        return ids == sorted(order.id for order in self.warehouse.orders) and all(
+            len(batch.orders) <= vehicle.max_nb_orders
+            and sum(order.volume for order in batch.orders) <= vehicle.max_volume
+            for batch in batches
+        )
+
+    def has_incumbent(self, result: Any) -> bool:
+        """The solver stopped at the time limit, with the warm start (or a better solution) as incumbent."""
+        return (
+            result.solver.termination_condition == pyo.TerminationCondition.maxTimeLimit
+        )
+
+    def read_pool(self, model: pyo.ConcreteModel, solver: Any) -> list[list[Batch]]:
+        """Distinct feasible batchings of the solution pool of a persistent Gurobi solver, the best first."""
+        if not isinstance(solver, PersistentSolver) or not hasattr(
+            solver, "_solver_model"
+        ):
+            return []
+
+        solver_model = solver._solver_model
+        variables = solver._pyomo_var_to_solver_var_map
+        pool, seen = [], set()
+
+        for k in range(min(solver_model.SolCount, self.pool_size)):
+            solver_model.Params.SolutionNumber = k
+
+            for var, solver_var in variables.items():
+                var.set_value(solver_var.Xn, skip_validation=True)
+
+            batches = self.build_solution(model)
+            key = frozenset(
+                frozenset(order.id for order in batch.orders) for batch in batches
+            )
+
+            if key not in seen and self.is_feasible(batches):
+                seen.add(key)
+                pool.append(batches)
+
+        return pool
+
+    def warm_start(self, model: pyo.ConcreteModel, batches: list[Batch]):
+        raise NotImplementedError
+
+    def build_solution(self, model: pyo.ConcreteModel) -> list[Batch]:
+        raise NotImplementedError
+
+    def solve(self) -> list[Batch]:
+        """
+        Entry point to optimize the batching model.
+        A fallback to the greedy batching is implemented in case the optimization fails.
+        """
+        with self.report.timer("time_warm_start"):
+            heuristic = self.greedy_solution()
+
+        is_start = len(heuristic) <= self.minimum_batches
+
+        if not is_start:
+            error(
+                f"Batching | Greedy batching with {len(heuristic)} batches for at most {self.minimum_batches} | No MIP start"
+            )
+
+        try:
+            with self.report.timer("time_model_build"):
+                model = self.build_model()
+
+                if is_start:
+                    self.warm_start(model, heuristic)
+
+            solver = pyo.SolverFactory(self.solver)
+            options = {"OutputFlag": int(self.verbose)}
+
+            if self.pool_size > 1:
+                options.update({"PoolSolutions": self.pool_size, "PoolSearchMode": 2})
+
+            result = self.optimize(model, options, warmstart=is_start, solver=solver)
+
+            if self.is_valid(result) or self.has_incumbent(result):
+                batches = self.build_solution(model)
+
+                if self.is_feasible(batches):
+                    self.pool = (
+                        self.read_pool(model, solver) if self.pool_size > 1 else []
+                    )
+
+                    return batches
+
+            raise Exception("Invalid batching solution")
+
+        except Exception as err:
+            error(
+                f"Batching | Optimization failed: {err} | Fallback to greedy batching"
+            )
+            self.pool = []
+
+            return heuristic
+
+
+class PMedian(BatchingModel):
     """
     # The p-median problem
 
@@ -17,20 +243,16 @@ class PMedian(Problem):
     """
 
     def closeness_objective(self, model: pyo.ConcreteModel) -> float:
-        closeness = Hausdorff().closeness
+        closeness = self.get_closeness()
 
-        return sum(
-            closeness(od_i, od_j) * model.x[i + 1, j + 1]
-            for i, od_i in enumerate(self.warehouse.orders)
-            for j, od_j in enumerate(self.warehouse.orders)
-        )
+        return sum(closeness[i - 1, j - 1] * model.x[i, j] for i, j in model.A)
 
     def unique_assignment_constraint(self, model: pyo.ConcreteModel, j: int):
-        return sum(model.x[i, j] for i in model.I) == 1
+        return sum(model.x[i, j] for i in model.N[j]) == 1
 
     def selected_batches_constraint(self, model: pyo.ConcreteModel, i: int):
         return (
-            sum(model.x[i, j] for j in model.J if j != i)
+            sum(model.x[i, j] for j in model.N[i] if j != i)
             <= (len(model.J) - model.p) * model.x[i, i]
         )
 
@@ -38,36 +260,44 @@ class PMedian(Problem):
         return sum(model.x[i, i] for i in model.I) <= model.p
 
     def unitary_capacity_constraint(self, model: pyo.ConcreteModel, i: int):
-        return sum(model.x[i, j] for j in model.J) <= model.C_unit
+        return sum(model.x[i, j] for j in model.N[i]) <= model.C_unit
 
     def volume_capacity_constraint(self, model: pyo.ConcreteModel, i: int):
         return (
-            sum(model.x[i, j] * self.warehouse.orders[j - 1].volume for j in model.J)
+            sum(model.x[i, j] * self.warehouse.orders[j - 1].volume for j in model.N[i])
             <= model.C_volume
         )
 
-    def symmetry_constraint(self, model: pyo.ConcreteModel, i: int, j: int):
-        if i < j:
-            return model.x[i, j] == model.x[j, i]
-
-        return pyo.Constraint.Skip
-
     def build_model(self) -> pyo.ConcreteModel:
+        """
+        The orders can only be assigned to a median among their nearest neighbors (candidate pairs),
+        which reduces the number of variables from O(n²) to O(n·k).
+        """
         model = pyo.ConcreteModel()
+        nb_orders = len(self.warehouse.orders)
+        neighbors = {i: [i] for i in range(1, nb_orders + 1)}
+
+        for i, j in self.get_candidates():
+            neighbors[i + 1].append(j + 1)
+            neighbors[j + 1].append(i + 1)
 
         # Parameters
-        model.I = pyo.RangeSet(len(self.warehouse.orders))
-        model.J = pyo.RangeSet(len(self.warehouse.orders))
+        model.I = pyo.RangeSet(nb_orders)
+        model.J = pyo.RangeSet(nb_orders)
+        model.N = pyo.Set(model.I, initialize=neighbors)
+        model.A = pyo.Set(
+            dimen=2, initialize=[(i, j) for i in model.I for j in neighbors[i]]
+        )
         model.p = self.minimum_batches
         model.C_unit = self.warehouse.vehicle.max_nb_orders
         model.C_volume = self.warehouse.vehicle.max_volume
 
         # Variables
-        model.x = pyo.Var(model.I, model.J, domain=pyo.Binary)
+        model.x = pyo.Var(model.A, domain=pyo.Binary)
 
         # Objective
         model.objective = pyo.Objective(
-            rule=self.closeness_objective, sense=pyo.maximize
+            rule=self.closeness_objective, sense=pyo.minimize
         )
 
         # Constraints
@@ -92,7 +322,7 @@ class PMedian(Problem):
             Batch(
                 orders=[
                     self.warehouse.orders[j - 1]
-                    for j in model.J
+                    for j in model.N[i]
                     if pyo.value(model.x[i, j]) > 0.5
                 ]
             )
@@ -101,48 +331,128 @@ class PMedian(Problem):
 
         return [batch for batch in batches if len(batch.orders) > 0]
 
-    def single_orders_fallback(self) -> list[Batch]:
-        """Fallback to return batches of single orders."""
-        return [Batch(orders=[order]) for order in self.warehouse.orders]
-
-    def solve(self) -> list[Batch]:
+    def warm_start(self, model: pyo.ConcreteModel, batches: list[Batch]):
         """
-        Entry point to optimize the p-median problem.
-        A fallback to single orders is implemented in case the optimization fails.
+        The median of each batch is the order closest to the others, among the orders that have all the others as neighbors.
+        The assignment of a batch without such an order is left to the solver (partial start).
         """
-        try:
-            model = self.build_model()
-            solver = pyo.SolverFactory("gurobi")
-            result = solver.solve(
-                model,
-                tee=self.verbose,
-                options={"TimeLimit": self.timeout, "OutputFlag": int(self.verbose)},
-            )
+        closeness = self.get_closeness()
+        index = {order.id: i for i, order in enumerate(self.warehouse.orders, 1)}
 
-            if self.is_valid(result):
-                return self.build_solution(model)
+        for i, j in model.A:
+            model.x[i, j].value = 0
 
-            raise Exception("Invalid batching solution")
+        for batch in batches:
+            members = [index[order.id] for order in batch.orders]
+            medians = [i for i in members if all(j in model.N[i] for j in members)]
 
-        except Exception as err:
-            error(f"Batching | Optimization failed: {err} | Fallback to single orders")
+            if medians:
+                median = min(
+                    medians,
+                    key=lambda i: sum(closeness[i - 1, j - 1] for j in members),
+                )
 
-            return self.single_orders_fallback()
+                for j in members:
+                    model.x[median, j].value = 1
+            else:
+                for j in members:
+                    for i in model.N[j]:
+                        model.x[i, j].value = None
 
 
 class Clustering(Problem):
-    """K-means constrained clustering."""
+    """
+    # Capacitated k-means clustering
+
+    The orders are embedded in a low-dimensional space, either by classical multidimensional scaling of the closeness matrix (`MDS`)
+    or by the centroids of their pick-up items (`Centroids`, which does not require the closeness matrix).
+    In the capacitated mode, each iteration assigns the orders, by decreasing regret, to the nearest of their `CLUSTERING_CANDIDATES` centers
+    with enough remaining volume and number of orders (in O(n·k)), then moves the centers to the mean of their orders.
+    An order that does not fit in any cluster opens a new one, so that the clusters are always feasible for the vehicle.
+    Otherwise, the clusters of `KMeansConstrained` (limited in number of orders only) are repaired by one capacitated assignment.
+    """
+
+    embedding: str = CLUSTERING_EMBEDDING_DEFAULT
+    capacitated: bool = True
 
     def build_model(self):
         """[Reference](https://joshlk.github.io/k-means-constrained/)"""
         return KMeansConstrained(
             n_clusters=self.minimum_batches,
             size_min=1,
-            size_max=self.warehouse.nb_orders,
-            random_state=0,
+            size_max=self.warehouse.vehicle.max_nb_orders,
+            random_state=CLUSTERING_SEED,
         )
 
-    def build_solution(self, solution: list[int]) -> list[Batch]:
+    def embed(self) -> np.ndarray:
+        if self.embedding not in CLUSTERING_EMBEDDINGS:
+            raise ValueError(f"Unknown embedding {self.embedding}")
+
+        if self.embedding == "Centroids":
+            return order_centroids(self.warehouse)
+
+        return classical_mds(self.get_closeness(), CLUSTERING_DIMENSIONS)
+
+    def initial_centers(self, points: np.ndarray) -> np.ndarray:
+        """K-means++ seeding: each center is drawn with a probability proportional to the squared distance to the nearest center."""
+        rng = np.random.default_rng(CLUSTERING_SEED)
+        centers = [points[rng.integers(len(points))]]
+        distances = np.square(points - centers[0]).sum(axis=1)
+
+        for _ in range(1, min(self.minimum_batches, len(points))):
+            total = distances.sum()
+            index = (
+                rng.choice(len(points), p=distances / total)
+                if total > 0
+                else rng.integers(len(points))
+            )
+            centers.append(points[index])
+            distances = np.minimum(
+                distances, np.square(points - points[index]).sum(axis=1)
+            )
+
+        return np.array(centers)
+
+    def assign(self, points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """Assign the orders to the nearest center with enough capacity, opening a new cluster if none fits."""
+        vehicle = self.warehouse.vehicle
+        volumes = [order.volume for order in self.warehouse.orders]
+        nb_candidates = min(CLUSTERING_CANDIDATES, len(centers))
+        distances, candidates = cKDTree(centers).query(points, k=nb_candidates)
+        distances = distances.reshape(len(points), -1)
+        candidates = candidates.reshape(len(points), -1)
+        regret = (
+            distances[:, 1] - distances[:, 0]
+            if nb_candidates > 1
+            else np.zeros(len(points))
+        )
+        centers = list(centers)
+        volume, count = [0] * len(centers), [0] * len(centers)
+        labels = np.full(len(points), -1)
+
+        for i in np.argsort(-regret, kind="stable"):
+            fits = lambda k: (
+                volume[k] + volumes[i] <= vehicle.max_volume
+                and count[k] < vehicle.max_nb_orders
+            )
+            cluster = next((k for k in candidates[i] if fits(k)), None)
+
+            if cluster is None:
+                others = np.argsort(np.square(np.array(centers) - points[i]).sum(1))
+                cluster = next((k for k in others if fits(k)), len(centers))
+
+            if cluster == len(centers):
+                centers.append(points[i])
+                volume.append(0)
+                count.append(0)
+
+            labels[i] = cluster
+            volume[cluster] += volumes[i]
+            count[cluster] += 1
+
+        return labels
+
+    def build_solution(self, solution: np.ndarray) -> list[Batch]:
         clusters = [
             Batch(
                 orders=[
@@ -151,39 +461,54 @@ class Clustering(Problem):
                     if cluster == k
                 ]
             )
-            for k in range(self.minimum_batches)
+            for k in np.unique(solution)
         ]
 
         return clusters
 
     def solve(self):
-        matrix = Hausdorff().build_matrix(orders=self.warehouse.orders)
-        model = self.build_model()
-        solution = model.fit_predict(matrix)
+        points = self.embed()
+
+        if not self.capacitated:
+            model = self.build_model()
+            model.fit_predict(points)
+
+            return self.build_solution(self.assign(points, model.cluster_centers_))
 
-        return self.build_solution(solution=solution)
+        centers = self.initial_centers(points)
+        labels = None
 
+        for _ in range(CLUSTERING_MAX_ITERATIONS):
+            _, assigned = np.unique(self.assign(points, centers), return_inverse=True)
 
-class GraphPartition(Problem):
+            if labels is not None and np.array_equal(assigned, labels):
+                break
+
+            labels = assigned
+            count = np.bincount(labels)
+            centers = np.column_stack(
+                [np.bincount(labels, weights=axis) / count for axis in points.T]
+            )
+
+        return self.build_solution(labels)
+
+
+class GraphPartition(BatchingModel):
     """Graph partitioning problem."""
 
     def closeness_objective(self, model: pyo.ConcreteModel) -> float:
-        closeness = Hausdorff().closeness
+        """Similarity of the candidate pairs of orders assigned to the same batch."""
+        closeness = self.get_closeness()
+        similarity = closeness.max() - closeness
 
-        return sum(
-            closeness(od_i, od_j) * model.x[i + 1, j + 1]
-            for i, od_i in enumerate(self.warehouse.orders)
-            for j, od_j in enumerate(self.warehouse.orders)
-        )
+        return sum(similarity[i - 1, j - 1] * model.x[i, j] for i, j in model.E)
 
     def unique_assignment_constraint(self, model: pyo.ConcreteModel, i: int):
         return sum(model.y[i, k] for k in model.K) == 1
 
     def intra_batch_constraint(self, model: pyo.ConcreteModel, i: int, j: int, k: int):
-        if i == j:
-            return pyo.Constraint.Skip
-
-        return model.y[i, k] + model.y[j, k] <= 1 + model.x[i, j]
+        """A pair of orders can only be rewarded if both are in the same batch."""
+        return model.x[min(i, j), max(i, j)] <= 1 + model.y[i, k] - model.y[j, k]
 
     def capacity_volume_constraint(self, model: pyo.ConcreteModel, k: int):
         return (
@@ -196,24 +521,23 @@ class GraphPartition(Problem):
             sum(model.y[i, k] for i in model.R) <= self.warehouse.vehicle.max_nb_orders
         )
 
-    def symmetry_constraint(self, model: pyo.ConcreteModel, i: int, j: int):
-        if i < j:
-            return model.x[i, j] == model.x[j, i]
-
-        elif i == j:
-            return model.x[i, j] == 0
-
-        return pyo.Constraint.Skip
-
     def build_model(self):
+        """
+        Only the candidate pairs of orders (nearest neighbors, i < j) have a pair variable,
+        which reduces the intra-batch constraints from O(n²·K) to O(n·k·K).
+        Since the pairs that are not candidates can not be penalized, the similarity of the pairs in the same batch is maximized.
+        """
         model = pyo.ConcreteModel()
+        edges = [(i + 1, j + 1) for i, j in self.get_candidates()]
 
         # Parameters
         model.R = pyo.RangeSet(len(self.warehouse.orders))
         model.K = pyo.RangeSet(self.minimum_batches)
+        model.E = pyo.Set(dimen=2, initialize=edges)
+        model.D = pyo.Set(dimen=2, initialize=edges + [(j, i) for i, j in edges])
 
         # Variables
-        model.x = pyo.Var(model.R, model.R, domain=pyo.Binary)
+        model.x = pyo.Var(model.E, domain=pyo.Binary)
         model.y = pyo.Var(model.R, model.K, domain=pyo.Binary)
 
         # Objective
@@ -226,7 +550,7 @@ class GraphPartition(Problem):
             model.R, rule=self.unique_assignment_constraint
         )
         model.intra_batch = pyo.Constraint(
-            model.R, model.R, model.K, rule=self.intra_batch_constraint
+            model.D, model.K, rule=self.intra_batch_constraint
         )
         model.capacity_volume = pyo.Constraint(
             model.K, rule=self.capacity_volume_constraint
@@ -234,7 +558,6 @@ class GraphPartition(Problem):
         model.capacity_quantity = pyo.Constraint(
             model.K, rule=self.capacity_quantity_constraint
         )
-        model.symmetry = pyo.Constraint(model.R, model.R, rule=self.symmetry_constraint)
 
         return model
 
@@ -251,3 +574,92 @@ class GraphPartition(Problem):
         ]
 
         return [batch for batch in batches if len(batch.orders) > 0]
+
+    def warm_start(self, model: pyo.ConcreteModel, batches: list[Batch]):
+        """Each batch of the greedy batching (at most as many as the model, see `solve`) is assigned to a batch of the model."""
+        index = {order.id: i for i, order in enumerate(self.warehouse.orders, 1)}
+        batch = {}
+
+        for k, members in zip(model.K, batches):
+            for order in members.orders:
+                batch[index[order.id]] = k
+
+        for i in model.R:
+            for k in model.K:
+                model.y[i, k].value = int(batch.get(i) == k) if i in batch else None
+
+        for i, j in model.E:
+            model.x[i, j].value = (
+                int(batch[i] == batch[j]) if i in batch and j in batch else None
+            )
+
+
+class Savings(Problem):
+    """
+    # Clarke-Wright savings
+
+    Each order starts in its own batch. The saving of merging two orders is the route length of each order alone
+    minus the route length of both orders together, estimated from the aisle subdivision of the warehouse
+    (or with a nearest neighbor route if it is not available).
+    The savings of the candidate pairs (nearest orders) are processed in decreasing order with a heap,
+    and the batches of both orders are merged (union-find) if the merged batch respects the capacity of the vehicle.
+    """
+
+    def get_savings(self) -> list[tuple[float, int, int]]:
+        """Savings of merging each candidate pair of orders, as a heap (negative savings first)."""
+        orders = self.warehouse.orders
+        route_length = self.get_estimator().estimate
+        positions = [[item.position_id for item in order.pickups] for order in orders]
+        lengths = [route_length(positions[i]) for i in range(len(orders))]
+        savings = []
+
+        for i, j in self.get_candidates():
+            merged = route_length(positions[i] + positions[j])
+            saving = lengths[i] + lengths[j] - merged
+
+            if saving > 0:
+                savings.append((-saving, i, j))
+
+        heapify(savings)
+
+        return savings
+
+    def solve(self) -> list[Batch]:
+        orders = self.warehouse.orders
+        vehicle = self.warehouse.vehicle
+        parent = list(range(len(orders)))
+        volume = [order.volume for order in orders]
+        size = [1] * len(orders)
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+
+            return i
+
+        savings = self.get_savings()
+
+        while savings:
+            _, i, j = heappop(savings)
+            root_i, root_j = find(i), find(j)
+
+            if root_i == root_j:
+                continue
+
+            if (
+                volume[root_i] + volume[root_j] > vehicle.max_volume
+                or size[root_i] + size[root_j] > vehicle.max_nb_orders
+            ):
+                continue
+
+            parent[root_j] = root_i
+            volume[root_i] += volume[root_j]
+            size[root_i] += size[root_j]
+
+        batches = {}
+
+        for i, order in enumerate(orders):
+            batches.setdefault(find(i), []).append(order)
+
+        return [Batch(orders=batch) for batch in batches.values()]
@@ -0,0 +1,251 @@
+from logging import info
+from time import time
+
+import numpy as np
+
+from domain.models.solutions import Batch, Problem
+
+LR_MAX_ITERATIONS = 200
+LR_STEP = 0.5  # initial Polyak step factor
+LR_PATIENCE = 10  # iterations without lower bound improvement before halving the step
+LR_MIN_STEP = 1e-3
+LR_TOLERANCE = 1e-6
+
+
+class PMedianLagrangian(Problem):
+    """
+    # Lagrangian relaxation of the p-median problem
+
+    The assignment constraints of the p-median problem (each order is served by exactly one median) are relaxed with multipliers λ.
+    The relaxed problem decomposes by median: a median serves itself and up to `max_nb_orders - 1` of its nearest orders
+    with negative reduced cost (closeness - λ), and the `p` medians with the most negative value are opened.
+    The volume capacity is dropped from the subproblems, which still gives a valid lower bound.
+    The subproblems are solved for all the medians at once with vectorized partial sorts, and the multipliers are updated by subgradient steps.
+    Each order can only be served by a median among its nearest orders (candidate pairs), as in the `PMedian` model.
+    At each iteration, the open medians are repaired into feasible batches: the orders are assigned by decreasing volume
+    to their closest candidate open median with enough capacity, to any open median if none fits, or become a median themselves.
+    Only the batchings that respect the candidate medians are upper bounds of the same problem as the lower bound,
+    and the gap between both bounds is reported, whereas the best batching with at most `p` batches is returned.
+    """
+
+    def build_neighbors(self) -> tuple[np.ndarray, np.ndarray]:
+        """Neighbors of each order (itself first), padded with itself at infinite closeness."""
+        closeness = self.get_closeness()
+        nb_orders = self.warehouse.nb_orders
+        neighbors = [[i] for i in range(nb_orders)]
+
+        for i, j in self.get_candidates():
+            neighbors[i].append(j)
+            neighbors[j].append(i)
+
+        width = max(len(row) for row in neighbors)
+        padded = np.array(
+            [row + [row[0]] * (width - len(row)) for row in neighbors], dtype=int
+        )
+        costs = closeness[np.arange(nb_orders)[:, None], padded].astype(float)
+        lengths = np.array([len(row) for row in neighbors])
+        costs[np.arange(width)[None, :] >= lengths[:, None]] = np.inf
+
+        return padded, costs
+
+    def relax(
+        self, multipliers: np.ndarray, neighbors: np.ndarray, costs: np.ndarray
+    ) -> tuple[float, np.ndarray, np.ndarray, np.ndarray]:
+        """Lower bound, median values, reduced costs and subgradient of the Lagrangian relaxation."""
+        nb_orders, width = neighbors.shape
+        nb_served = min(self.warehouse.vehicle.max_nb_orders - 1, width - 1)
+        reduced = costs - multipliers[neighbors]
+        others = reduced[:, 1:]
+
+        if 0 < nb_served < width - 1:
+            served = np.argpartition(others, nb_served - 1, axis=1)[:, :nb_served]
+        else:
+            served = np.tile(np.arange(width - 1), (nb_orders, 1))[:, :nb_served]
+
+        gains = np.take_along_axis(others, served, axis=1)
+        values = reduced[:, 0] + np.minimum(gains, 0).sum(axis=1)
+        nb_medians = min(self.minimum_batches, nb_orders)
+        medians = np.argpartition(values, nb_medians - 1)[:nb_medians]
+        medians = medians[values[medians] < 0]
+
+        served = np.take_along_axis(neighbors[:, 1:], served, axis=1)[medians]
+        coverage = np.bincount(
+            np.concatenate([medians, served[gains[medians] < 0]]), minlength=nb_orders
+        )
+        bound = multipliers.sum() + values[medians].sum()
+
+        return bound, values, reduced, 1 - coverage
+
+    def repair(
+        self,
+        values: np.ndarray,
+        reduced: np.ndarray,
+        neighbors: np.ndarray,
+    ) -> tuple[float, np.ndarray, bool]:
+        """
+        Feasible batching of the orders, its total closeness, and whether each order is served by one of its candidate medians.
+        The `p` unassigned orders of lowest median value are opened in that order, each serving its unassigned neighbors
+        of negative reduced cost while the capacity allows it. The remaining orders are assigned to their closest open median
+        among their neighbors (the same restriction as the relaxation, so that both bounds are for the same problem) with enough capacity
+        (possibly after moving one of its orders to another of their candidate medians).
+        Otherwise, they are assigned to their closest open median with enough capacity (and the cost is not an upper bound of the restricted problem),
+        or become a median themselves if none fits (and the cost is not an upper bound if more than `p` medians are open).
+        """
+        closeness = self.get_closeness()
+        max_volume = self.warehouse.vehicle.max_volume
+        max_nb_orders = self.warehouse.vehicle.max_nb_orders
+        volumes = np.array([order.volume for order in self.warehouse.orders])
+        labels = np.full(len(volumes), -1)
+        volume, count = {}, {}
+        nb_medians = self.minimum_batches
+        total, is_restricted = 0, True
+
+        fits = lambda i, j: (
+            volume[i] + volumes[j] <= max_volume and count[i] < max_nb_orders
+        )
+
+        def assign(i: int, j: int):
+            nonlocal total
+            labels[j] = i
+            volume[i] += volumes[j]
+            count[i] += 1
+            total += closeness[i, j]
+
+        def make_room(i: int, j: int) -> bool:
+            """Move an order of the median `i` to another of its open candidate medians, so that the order `j` fits in `i`."""
+            nonlocal total
+
+            for k in np.flatnonzero(labels == i):
+                if k == i or volume[i] - volumes[k] + volumes[j] > max_volume:
+                    continue
+
+                other = next(
+                    (
+                        m
+                        for m in neighbors[k, 1:]
+                        if is_open[m] and m != i and fits(m, k)
+                    ),
+                    None,
+                )
+
+                if other is not None:
+                    volume[i], count[i] = volume[i] - volumes[k], count[i] - 1
+                    total -= closeness[i, k]
+                    assign(other, k)
+
+                    return True
+
+            return False
+
+        ranks = np.argsort(reduced[:, 1:], axis=1, kind="stable") + 1
+
+        for i in np.argsort(values, kind="stable"):
+            if len(volume) == nb_medians:
+                break
+
+            if labels[i] >= 0:
+                continue
+
+            volume[i], count[i] = 0, 0
+            assign(i, i)
+
+            for column in ranks[i]:
+                j = neighbors[i, column]
+
+                if reduced[i, column] >= 0 or count[i] == max_nb_orders:
+                    break
+
+                if labels[j] < 0 and fits(i, j):
+                    assign(i, j)
+
+        is_open = np.zeros(len(volumes), dtype=bool)
+        is_open[list(volume)] = True
+        pending = np.argsort(-volumes, kind="stable")
+
+        for j in pending[labels[pending] < 0]:
+            candidates = neighbors[j, 1:][is_open[neighbors[j, 1:]]]
+            candidates = candidates[np.argsort(closeness[candidates, j], kind="stable")]
+            median = next((i for i in candidates if fits(i, j)), None)
+
+            if median is None:
+                median = next((i for i in candidates if make_room(i, j)), None)
+
+            if median is None:
+                opened = np.flatnonzero(is_open)
+                opened = opened[np.argsort(closeness[j, opened], kind="stable")]
+                median = next((i for i in opened if fits(i, j)), None)
+                is_restricted = False
+
+            if median is None:
+                median, volume[j], count[j], is_open[j] = j, 0, 0, True
+
+            assign(median, j)
+
+        return total, labels, is_restricted
+
+    def solve(self) -> list[Batch]:
+        start = time()
+        orders = self.warehouse.orders
+        neighbors, costs = self.build_neighbors()
+        # Closeness to the nearest other order, as initial multipliers
+        multipliers = np.min(costs[:, 1:], axis=1, initial=np.inf)
+        multipliers[np.isinf(multipliers)] = 0
+        lower_bound, upper_bound, labels = -np.inf, np.inf, None
+        # Cost of the returned batching, which may not respect the candidate medians
+        best_cost = np.inf
+        nb_medians = self.minimum_batches
+        step, stalled = LR_STEP, 0
+
+        for iteration in range(LR_MAX_ITERATIONS):
+            bound, values, reduced, subgradient = self.relax(
+                multipliers, neighbors, costs
+            )
+            cost, assignment, is_restricted = self.repair(values, reduced, neighbors)
+            valid = len(np.unique(assignment)) <= nb_medians
+
+            if labels is None or (valid and cost < best_cost):
+                labels, best_cost = assignment, cost if valid else np.inf
+
+            if valid and is_restricted:
+                upper_bound = min(upper_bound, cost)
+
+            if bound > lower_bound + LR_TOLERANCE:
+                lower_bound, stalled = bound, 0
+            else:
+                stalled += 1
+
+                if stalled >= LR_PATIENCE:
+                    step, stalled = step / 2, 0
+
+            norm = np.square(subgradient).sum()
+
+            if (
+                norm == 0
+                or step < LR_MIN_STEP
+                or upper_bound - lower_bound <= LR_TOLERANCE
+                or time() - start > self.timeout
+            ):
+                break
+
+            # Polyak step towards the best valid solution (or the current one until there is one)
+            target = upper_bound if np.isfinite(upper_bound) else max(cost, bound)
+            multipliers = multipliers + step * (target - bound) / norm * subgradient
+
+        gap = (
+            (upper_bound - lower_bound) / upper_bound
+            if np.isfinite(upper_bound) and upper_bound > 0
+            else np.inf
+        )
+        info(
+            f"PMedianLagrangian | Iterations {iteration + 1} | Lower bound {round(lower_bound, 2)} | Upper bound {round(upper_bound, 2)} | Gap {gap:.2%}"
+        )
+        self.report.record("lower_bound", lower_bound)
+        self.report.record("upper_bound", upper_bound)
+        self.report.record("gap", gap)
+
+        batches = {}
+
+        for j, median in enumerate(labels):
+            batches.setdefault(median, []).append(orders[j])
+
+        return [Batch(orders=batch) for batch in batches.values()]
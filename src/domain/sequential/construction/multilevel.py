@@ -0,0 +1,226 @@
+from logging import info
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from scipy.spatial import cKDTree
+
+from domain.models.solutions import Batch, Problem
+from services.distances import nearest_neighbors, order_centroids
+
+ML_MIN_SHRINK = 0.99  # stop coarsening when a level keeps more than 99% of the nodes
+ML_REFINEMENT_PASSES = 5
+# Number of nearest parts considered for a merge in the initial partition
+ML_PARTITION_NEIGHBORS = 10
+ML_SEED = 0
+
+
+class MultilevelPartition(Problem):
+    """
+    # Multilevel graph partitioning
+
+    Heuristic partitioning of the order-closeness graph, where each order is connected to its nearest orders
+    and the edges are weighted by their similarity (the inverse of the distance between the order centroids).
+    1. Coarsening: the nodes are merged by heavy-edge matching, as long as the merged node respects the capacity of the vehicle.
+    2. Partitioning: when the graph can not be coarsened anymore, the coarse nodes are the initial parts (batches),
+    which are merged greedily with their nearest parts (by centroid) while the capacity of the vehicle allows it.
+    3. Uncoarsening: the parts are projected back to the finer levels, where the nodes are moved between adjacent parts
+    with a Fiduccia-Mattheyses refinement: the gains of all the nodes are evaluated at once with sparse products,
+    and the moves with positive gain are applied in decreasing order of gain if the capacity of the target part allows it.
+    The graph is sparse (O(n·k) edges), so that it scales to tens of thousands of orders.
+    """
+
+    def build_graph(self) -> csr_matrix:
+        distances, neighbors = nearest_neighbors(self.warehouse, self.nb_neighbors)
+        nb_orders = self.warehouse.nb_orders
+        rows = np.repeat(np.arange(nb_orders), neighbors.shape[1])
+        columns = neighbors.ravel()
+        weights = 1 / (1 + distances.ravel())
+        mask = rows != columns
+        graph = csr_matrix(
+            (weights[mask], (rows[mask], columns[mask])), shape=(nb_orders, nb_orders)
+        )
+
+        return graph.maximum(graph.T).tocsr()
+
+    def is_feasible(self, volume: float, count: int) -> bool:
+        vehicle = self.warehouse.vehicle
+
+        return volume <= vehicle.max_volume and count <= vehicle.max_nb_orders
+
+    def match(
+        self, graph: csr_matrix, volume: np.ndarray, count: np.ndarray
+    ) -> np.ndarray:
+        """Heavy-edge matching: each node is matched with the unmatched neighbor of heaviest edge that fits in the capacity."""
+        nb_nodes = graph.shape[0]
+        matching = np.full(nb_nodes, -1)
+        rng = np.random.default_rng(ML_SEED)
+
+        for i in rng.permutation(nb_nodes):
+            if matching[i] >= 0:
+                continue
+
+            start, end = graph.indptr[i], graph.indptr[i + 1]
+            neighbors, weights = graph.indices[start:end], graph.data[start:end]
+            matching[i] = i
+
+            for j in neighbors[np.argsort(-weights, kind="stable")]:
+                if matching[j] < 0 and self.is_feasible(
+                    volume[i] + volume[j], count[i] + count[j]
+                ):
+                    matching[i], matching[j] = j, i
+                    break
+
+        # Coarse node of each node, numbered by the lowest node of each pair
+        leaders = np.minimum(np.arange(nb_nodes), matching)
+        _, coarse = np.unique(leaders, return_inverse=True)
+
+        return coarse
+
+    def coarsen(self, graph: csr_matrix, coarse: np.ndarray) -> csr_matrix:
+        """Graph of the coarse nodes, where the edges between the merged nodes are aggregated."""
+        membership = csr_matrix(
+            (np.ones(len(coarse)), (np.arange(len(coarse)), coarse)),
+            shape=(len(coarse), coarse.max() + 1),
+        )
+        coarse_graph = (membership.T @ graph @ membership).tocsr()
+        coarse_graph -= diags(coarse_graph.diagonal())
+        coarse_graph.eliminate_zeros()
+
+        return coarse_graph
+
+    def partition(
+        self, centroids: np.ndarray, volume: np.ndarray, count: np.ndarray
+    ) -> np.ndarray:
+        """Merge each part with its nearest feasible part, smallest parts first, until no merge is possible."""
+        parts = np.arange(len(volume))
+
+        while True:
+            labels, parts = np.unique(parts, return_inverse=True)
+            part_count = np.bincount(parts, weights=count)
+            part_volume = np.bincount(parts, weights=volume)
+            part_centroids = np.column_stack(
+                [
+                    np.bincount(parts, weights=axis * count) / part_count
+                    for axis in centroids.T
+                ]
+            )
+            nb_neighbors = min(ML_PARTITION_NEIGHBORS, len(labels) - 1)
+
+            if nb_neighbors == 0:
+                break
+
+            _, neighbors = cKDTree(part_centroids).query(
+                part_centroids, k=nb_neighbors + 1
+            )
+            merged = np.full(len(labels), -1)
+
+            for i in np.argsort(part_volume, kind="stable"):
+                if merged[i] >= 0:
+                    continue
+
+                for j in neighbors[i]:
+                    if (
+                        j != i
+                        and merged[j] < 0
+                        and self.is_feasible(
+                            part_volume[i] + part_volume[j],
+                            part_count[i] + part_count[j],
+                        )
+                    ):
+                        merged[i] = merged[j] = min(i, j)
+                        break
+
+            if np.all(merged < 0):
+                break
+
+            parts = np.where(merged < 0, np.arange(len(labels)), merged)[parts]
+
+        return parts
+
+    def refine(
+        self,
+        graph: csr_matrix,
+        volume: np.ndarray,
+        count: np.ndarray,
+        parts: np.ndarray,
+    ) -> np.ndarray:
+        """Move the nodes to the adjacent part with the largest (positive) gain in intra-part similarity."""
+        nb_nodes, nb_parts = graph.shape[0], parts.max() + 1
+
+        for _ in range(ML_REFINEMENT_PASSES):
+            membership = csr_matrix(
+                (np.ones(nb_nodes), (np.arange(nb_nodes), parts)),
+                shape=(nb_nodes, nb_parts),
+            )
+            connectivity = (graph @ membership).tocsr()
+            internal = np.asarray(connectivity.multiply(membership).sum(axis=1)).ravel()
+            external = connectivity - connectivity.multiply(membership)
+            targets = np.asarray(external.argmax(axis=1)).ravel()
+            gains = np.asarray(external.max(axis=1).todense()).ravel() - internal
+
+            part_volume = np.bincount(parts, weights=volume, minlength=nb_parts)
+            part_count = np.bincount(parts, weights=count, minlength=nb_parts)
+            moves = 0
+
+            for i in np.flatnonzero(gains > 0)[np.argsort(-gains[gains > 0])]:
+                source, target = parts[i], targets[i]
+
+                if not self.is_feasible(
+                    part_volume[target] + volume[i], part_count[target] + count[i]
+                ):
+                    continue
+
+                parts[i] = target
+                part_volume[source] -= volume[i]
+                part_count[source] -= count[i]
+                part_volume[target] += volume[i]
+                part_count[target] += count[i]
+                moves += 1
+
+            if moves == 0:
+                break
+
+        return parts
+
+    def solve(self) -> list[Batch]:
+        orders = self.warehouse.orders
+        graph = self.build_graph()
+        volume = np.array([order.volume for order in orders], dtype=float)
+        count = np.ones(len(orders))
+        centroids = order_centroids(self.warehouse)
+        levels = []
+
+        # Coarsening
+        while True:
+            coarse = self.match(graph, volume, count)
+
+            if coarse.max() + 1 > ML_MIN_SHRINK * len(coarse):
+                break
+
+            levels.append((graph, volume, count, coarse))
+            graph = self.coarsen(graph, coarse)
+            volume = np.bincount(coarse, weights=volume)
+            centroids = np.column_stack(
+                [np.bincount(coarse, weights=axis * count) for axis in centroids.T]
+            )
+            count = np.bincount(coarse, weights=count)
+            centroids /= count[:, None]
+
+        # Initial partition of the coarsest graph
+        parts = self.refine(
+            graph, volume, count, self.partition(centroids, volume, count)
+        )
+        info(
+            f"Multilevel partition | Levels {len(levels)} | Parts {len(np.unique(parts))} | Orders {len(orders)}"
+        )
+
+        # Uncoarsening
+        for graph, volume, count, coarse in reversed(levels):
+            parts = self.refine(graph, volume, count, parts[coarse])
+
+        _, parts = np.unique(parts, return_inverse=True)
+
+        return [
+            Batch(orders=[orders[i] for i in np.flatnonzero(parts == k)])
+            for k in range(parts.max() + 1)
+        ]
@@ -0,0 +1,233 @@
+from logging import error, info
+from time import time
+from typing import Any
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+from scipy.sparse import csc_matrix
+
+from domain.models.solutions import Batch, Problem
+from domain.sequential.construction.batching import Savings
+from services.cache import ColumnCache
+
+CG_MAX_ITERATIONS = 100
+CG_PRICING_SHARE = 0.7  # share of the time limit for the column generation (the rest for the integer master)
+CG_COLUMNS_PER_ITERATION = 100  # most negative reduced costs added per iteration
+CG_INTEGER_MAX_COLUMNS = 1000  # lowest reduced costs kept in the integer master
+CG_MAX_CACHED_COLUMNS = 5000  # columns of an instance kept in the cache
+CG_MAX_CACHED_COSTS = 10**6  # route costs of a warehouse kept in the cache
+CG_TOLERANCE = 1e-6
+
+
+class SetPartitioning(Problem):
+    """
+    # Set partitioning by column generation
+
+    Each column is a capacity-feasible batch of orders, whose cost is its estimated route length.
+    The master problem selects the columns that cover each order exactly once at the minimum cost.
+    Starting from the single-order batches and the `Savings` solution, the linear relaxation of the master problem is solved with HiGHS,
+    and new columns are priced with the dual values: from each order, a batch is grown greedily with its nearest orders while the reduced cost decreases.
+    When no column with negative reduced cost is found, the restricted master problem is solved with integer variables.
+    The columns and the route costs are cached on disk, so that each run on the same instance (or warehouse) starts from the previous ones.
+    """
+
+    columns: list[tuple[int, ...]] = []
+    costs: dict[tuple[int, ...], float] = {}
+    estimator: Any = None
+
+    def positions(self, column: tuple[int, ...]) -> tuple[int, ...]:
+        orders = self.warehouse.orders
+
+        return tuple(
+            sorted(set(item.position_id for i in column for item in orders[i].pickups))
+        )
+
+    def cost(self, column: tuple[int, ...]) -> float:
+        """Route cost oracle, cached by the positions of the batch."""
+        positions = self.positions(column)
+
+        if positions not in self.costs:
+            self.costs[positions] = self.estimator.estimate(list(positions))
+
+        return self.costs[positions]
+
+    def is_feasible(self, column: tuple[int, ...]) -> bool:
+        vehicle = self.warehouse.vehicle
+        volume = sum(self.warehouse.orders[i].volume for i in column)
+
+        return len(column) <= vehicle.max_nb_orders and volume <= vehicle.max_volume
+
+    def add_columns(self, columns: list[tuple[int, ...]]) -> int:
+        existing = set(self.columns)
+        new_columns = [
+            column
+            for column in dict.fromkeys(tuple(sorted(column)) for column in columns)
+            if column not in existing and self.is_feasible(column)
+        ]
+        self.columns.extend(new_columns)
+
+        return len(new_columns)
+
+    def master(self) -> tuple[np.ndarray, csc_matrix]:
+        """Costs and order-column incidence matrix of the master problem."""
+        costs = np.array([self.cost(column) for column in self.columns])
+        rows = [i for column in self.columns for i in column]
+        columns = [j for j, column in enumerate(self.columns) for _ in column]
+        matrix = csc_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(self.warehouse.nb_orders, len(self.columns)),
+        )
+
+        return costs, matrix
+
+    def solve_relaxation(self) -> np.ndarray:
+        """Solve the linear relaxation of the master problem and return the dual values of the orders."""
+        costs, matrix = self.master()
+        nb_orders = self.warehouse.nb_orders
+        result = linprog(costs, A_eq=matrix, b_eq=np.ones(nb_orders), method="highs")
+
+        if result.status != 0:
+            raise ValueError(f"Set partitioning | Relaxation failed: {result.message}")
+
+        info(
+            f"Set partitioning | Columns {len(self.columns)} | Relaxation {round(result.fun, 2)}"
+        )
+
+        return result.eqlin.marginals
+
+    def price(self, duals: np.ndarray, neighbors: dict[int, list[int]]) -> list:
+        """
+        Grow a batch from each order, adding the neighbor order that most decreases the reduced cost,
+        and keep the batches with negative reduced cost.
+        """
+        candidates = {}
+
+        for seed in range(self.warehouse.nb_orders):
+            column = (seed,)
+            reduced_cost = self.cost(column) - duals[seed]
+
+            while True:
+                best, best_reduced_cost = None, reduced_cost
+
+                for j in neighbors[seed]:
+                    extended = column + (j,)
+
+                    if j in column or not self.is_feasible(extended):
+                        continue
+
+                    value = self.cost(extended) - duals[list(extended)].sum()
+
+                    if value < best_reduced_cost - CG_TOLERANCE:
+                        best, best_reduced_cost = j, value
+
+                if best is None:
+                    break
+
+                column, reduced_cost = column + (best,), best_reduced_cost
+
+                if reduced_cost < -CG_TOLERANCE:
+                    candidates[tuple(sorted(column))] = reduced_cost
+
+        return sorted(candidates, key=candidates.get)[:CG_COLUMNS_PER_ITERATION]
+
+    def solve_integer(
+        self, duals: np.ndarray, initial: list[tuple[int, ...]], timeout: float
+    ) -> list[tuple[int, ...]]:
+        """
+        Solve the restricted master problem with integer variables,
+        over the columns with the lowest reduced costs and the initial solution (to ensure feasibility).
+        """
+        costs, matrix = self.master()
+        reduced_costs = costs - matrix.T @ duals
+        reduced_costs[[self.columns.index(column) for column in initial]] = -np.inf
+        selected = np.sort(np.argsort(reduced_costs)[:CG_INTEGER_MAX_COLUMNS])
+        costs, matrix = costs[selected], matrix[:, selected]
+        nb_orders = self.warehouse.nb_orders
+        result = milp(
+            costs,
+            constraints=LinearConstraint(
+                matrix, np.ones(nb_orders), np.ones(nb_orders)
+            ),
+            integrality=np.ones(len(costs)),
+            bounds=Bounds(0, 1),
+            options={"time_limit": timeout, "disp": self.verbose},
+        )
+
+        if result.x is None:
+            raise ValueError(
+                f"Set partitioning | Integer master failed: {result.message}"
+            )
+
+        return [self.columns[j] for j, x in zip(selected, result.x) if x > 0.5]
+
+    def get_neighbors(self) -> dict[int, list[int]]:
+        neighbors = {i: [] for i in range(self.warehouse.nb_orders)}
+
+        for i, j in self.get_candidates():
+            neighbors[i].append(j)
+            neighbors[j].append(i)
+
+        return neighbors
+
+    def total_cost(self, columns: list[tuple[int, ...]]) -> float:
+        return sum(self.cost(column) for column in columns)
+
+    def solve(self) -> list[Batch]:
+        start = time()
+        orders = self.warehouse.orders
+        index = {order.id: i for i, order in enumerate(orders)}
+        to_column = lambda batch: tuple(sorted(index[od.id] for od in batch.orders))
+        self.estimator = self.get_estimator()
+        cache = ColumnCache()
+        # Keyed on the estimator actually used (the fallback without aisle subdivision)
+        layout = cache.layout(self.warehouse, type(self.estimator).__name__)
+        instance = cache.fingerprint(self.warehouse, "columns")
+        data = cache.load(layout)
+
+        self.costs = data["costs"]
+        self.columns = []
+        initial = Savings(**self.__dict__).solve()
+        self.add_columns([(i,) for i in range(len(orders))])
+        self.add_columns([to_column(batch) for batch in initial])
+        self.add_columns(data["columns"].get(instance, []))
+        neighbors = self.get_neighbors()
+        batches = initial
+
+        try:
+            for iteration in range(CG_MAX_ITERATIONS):
+                duals = self.solve_relaxation()
+
+                if time() - start > CG_PRICING_SHARE * self.timeout:
+                    break
+
+                if self.add_columns(self.price(duals, neighbors)) == 0:
+                    break
+
+            info(
+                f"Set partitioning | Iterations {iteration + 1} | Columns {len(self.columns)}"
+            )
+            self.report.record("nb_columns", len(self.columns))
+            initial_columns = [to_column(batch) for batch in initial]
+            remaining = self.timeout - (time() - start)
+            selected = initial_columns
+
+            if remaining > 0:
+                selected = self.solve_integer(duals, initial_columns, remaining)
+            else:
+                info("Set partitioning | Time budget exhausted | Savings solution kept")
+
+            if self.total_cost(selected) < self.total_cost(initial_columns):
+                batches = [
+                    Batch(orders=[orders[i] for i in column]) for column in selected
+                ]
+
+        except Exception as err:
+            error(f"Batching | Set partitioning failed: {err} | Fallback to Savings")
+
+        # Cache the selected columns first, then the most recent ones
+        columns = [to_column(batch) for batch in batches] + self.columns[::-1]
+        data["columns"][instance] = list(dict.fromkeys(columns))[:CG_MAX_CACHED_COLUMNS]
+        data["costs"] = dict(list(self.costs.items())[-CG_MAX_CACHED_COSTS:])
+        cache.save(layout, data)
+
+        return batches
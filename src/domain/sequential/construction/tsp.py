@@ -196,6 +196,9 @@ class TSPBase(Routing):
         model._vars = is_edge
         model.Params.lazyConstraints = 1
 
+        for name, value in self.time_limits.items():
+            model.setParam(name, value)
+
         model.optimize(lambda model, where: self.subtour_elimination(model, where))
         value = 0
 
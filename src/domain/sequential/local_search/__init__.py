@@ -1,12 +1,30 @@
+from contextlib import nullcontext
 from logging import debug, info
+from os import cpu_count
 from random import choice
-from typing import Any
+from typing import Any, Optional
+
+import numpy as np
 
 from domain.models.solutions import Batch, Problem
-from domain.sequential.local_search.operators import Move, Relocate, Swap
+from domain.sequential.local_search.alns import ALNS
+from domain.sequential.local_search.assignment import Assignment
+from domain.sequential.local_search.neighborhood import Neighborhood
+from domain.sequential.local_search.operators import (
+    InsertionMove,
+    InsertionRelocate,
+    InsertionSwap,
+    Move,
+    Relocate,
+    Swap,
+)
 from domain.sequential.local_search.search import SimmulatedAnnealing, TabuSearch
 
 LS_MAX_ITERATIONS = 10
+LS_DELTA_MAX_ITERATIONS = 5000  # moves are evaluated without routing
+# The deltas of single moves are small compared with the default temperature
+LS_DELTA_TEMPERATURE = 5.0
+LS_PARALLEL_CANDIDATES = 64  # candidate moves evaluated at once by the process pool
 
 
 class LocalSearch(Problem):
@@ -15,12 +33,19 @@ class LocalSearch(Problem):
 
     Due that the batch structure is un-mutable in the routing problem, two move operators applied to the incumbent solution: the swap and the relocate operators.
     At each iteration, until the stopping criterion is met, a move operator is randomly selected and the first-improving solution is obtained.
+    With `delta_evaluation`, the moves are scored by removal and cheapest-insertion deltas on the current routes,
+    and only the batches of the accepted moves are routed again, so that thousands of iterations fit in the time budget.
+    With `parallel_evaluation`, a larger sample of insertion moves is evaluated at each iteration by a pool of processes,
+    and the best non-tabu move is proposed to the acceptance criterion.
     """
 
     current_solution: list[Batch]
     routing_method: Any
     operators: list[Move] = []
     strategies: dict[str, Any] = {}
+    delta_evaluation: bool = False
+    parallel_evaluation: bool = False
+    neighborhood: Optional[Neighborhood] = None
 
     @property
     def tabu_search(self) -> TabuSearch:
@@ -30,39 +55,87 @@ class LocalSearch(Problem):
     def simulated_annealing(self) -> SimmulatedAnnealing:
         return self.strategies["simulated_annealing"]
 
+    @property
+    def insertion_moves(self) -> bool:
+        return self.delta_evaluation or self.parallel_evaluation
+
+    @property
+    def max_iterations(self) -> int:
+        return LS_DELTA_MAX_ITERATIONS if self.insertion_moves else LS_MAX_ITERATIONS
+
     def to_diversify(self, count: int) -> bool:
         """Diversify the search at the half of the iterations."""
-        return count > LS_MAX_ITERATIONS // 2
+        return count > self.max_iterations // 2
 
     def initialize(self):
-        operator_params = {
-            "routing_method": self.routing_method,
-        }
-        self.operators = [Relocate(**operator_params), Swap(**operator_params)]
         self.strategies = {
-            "simulated_annealing": SimmulatedAnnealing(),
+            "simulated_annealing": (
+                SimmulatedAnnealing(temperature=LS_DELTA_TEMPERATURE)
+                if self.insertion_moves
+                else SimmulatedAnnealing()
+            ),
             "tabu_search": TabuSearch(),
         }
+        matrix = self.warehouse.distances.matrix
+        matrix = np.where(np.isnan(matrix) | (matrix < 0), 0, matrix)
+        operator_params = {
+            "routing_method": self.routing_method,
+            "estimator": self.get_estimator(),
+            "matrix": matrix,
+            "vehicle": self.warehouse.vehicle,
+        }
+
+        if not self.insertion_moves:
+            self.operators = [Relocate(**operator_params), Swap(**operator_params)]
+            return
+
+        nb_workers = (cpu_count() or 1) if self.parallel_evaluation else 1
+        self.neighborhood = Neighborhood(matrix=matrix, nb_workers=nb_workers)
+        operator_params.update(
+            assignment=Assignment.from_solution(
+                self.current_solution, self.warehouse.vehicle
+            ),
+            neighborhood=self.neighborhood,
+            is_tabu=self.tabu_search.is_tabu,
+        )
+
+        if self.parallel_evaluation:
+            operator_params["nb_candidates"] = LS_PARALLEL_CANDIDATES
+
+        self.operators = [
+            InsertionRelocate(**operator_params),
+            InsertionSwap(**operator_params),
+        ]
 
     def should_continue(self, count: int) -> bool:
+        """Stop at the maximum number of iterations or when the local search budget is exhausted."""
+        if self.deadline is not None and self.deadline.is_expired():
+            return False
+
+        if self.insertion_moves:
+            return count < self.max_iterations
+
         return False  # count < LS_MAX_ITERATIONS
 
     def compute_distance(self, solution: list[Batch]) -> float:
         return sum(batch.metrics.distance for batch in solution)
 
-    def should_accept(self, new_solution: list[Batch], count: int) -> bool:
+    def should_accept(
+        self, new_solution: list[Batch], count: int, value: Optional[int] = None
+    ) -> bool:
         """
         # Acceptance criterion
 
         Integrate tabu search memory and the simulated annealing strategies to accept or reject the new solution.
         The solution is accepted if it is not tabu and it is better than the current solution (based on the Metropolis criterion).
+        The hash of the new solution is computed from its batches unless it is given (e.g. maintained by the assignment).
         """
-        if self.tabu_search.is_tabu(new_solution):
+        value = self.tabu_search.hash(new_solution) if value is None else value
+
+        if self.tabu_search.is_tabu(value):
             return False
 
-        self.tabu_search.update_memory(
-            new_solution, to_diversify=self.to_diversify(count)
-        )
+        self.tabu_search.update_memory(value, to_diversify=self.to_diversify(count))
 
         improvement = self.compute_distance(
             self.current_solution
@@ -80,19 +153,39 @@ class LocalSearch(Problem):
         """Local search algorithm to improve the initial solution."""
         count = 0
         self.initialize()
-        info(f"Starting local search with {LS_MAX_ITERATIONS} iterations.")
+        info(f"Starting local search with {self.max_iterations} iterations.")
         best_solution = self.current_solution
 
-        while self.should_continue(count):
-            count += 1
-            operator = self.select_operator()
-            new_solution = operator.apply(self.current_solution)
-
-            if self.should_accept(new_solution, count):
-                debug(
-                    f"Local search | Iteration {count} | Accepted new solution with distance {self.compute_distance(new_solution)}."
+        with self.neighborhood or nullcontext():
+            while self.should_continue(count):
+                count += 1
+                operator = self.select_operator()
+                new_solution = operator.apply(self.current_solution)
+                value = (
+                    operator.assignment.value
+                    if isinstance(operator, InsertionMove)
+                    else None
                 )
-                self.current_solution = new_solution
+
+                if self.should_accept(new_solution, count, value):
+                    if isinstance(operator, InsertionMove):
+                        new_solution = [
+                            operator.reroute(new) if new is not old else new
+                            for old, new in zip(self.current_solution, new_solution)
+                        ]
+
+                    debug(
+                        f"Local search | Iteration {count} | Accepted new solution with distance {self.compute_distance(new_solution)}."
+                    )
+                    self.current_solution = new_solution
+
+                    if self.compute_distance(new_solution) < self.compute_distance(
+                        best_solution
+                    ):
+                        best_solution = new_solution
+
+                elif isinstance(operator, InsertionMove):
+                    operator.reject()
 
         info(f"Local search finished after {count} iterations.")
 
@@ -104,3 +197,7 @@ class LocalSearch(Problem):
         )
 
         return final_solution
+
+
+LOCAL_SEARCH_METHOD_DEFAULT = "LocalSearch"
+LOCAL_SEARCH_METHODS = {"LocalSearch": LocalSearch, "ALNS": ALNS}
@@ -0,0 +1,424 @@
+from logging import debug, info
+from random import randint, random, sample
+from time import time
+from typing import Any, Callable
+
+import numpy as np
+from pydantic import BaseModel
+
+from domain.models.instances import Order
+from domain.models.solutions import Batch, Problem
+from domain.sequential.local_search.neighborhood import (
+    cheapest_insertion,
+    route_length,
+)
+from domain.sequential.local_search.operators import InsertionMove
+from domain.sequential.local_search.search import SimmulatedAnnealing
+from services.distances import order_centroids
+
+ALNS_MAX_ITERATIONS = 100_000  # the search is mainly bounded by the time budget
+# Share of the time budget for the search, the rest is left to route the best solution
+ALNS_SEARCH_SHARE = 0.8
+ALNS_MIN_REMOVAL = 2
+ALNS_MAX_REMOVAL = 15
+ALNS_REMOVAL_SHARE = 0.1  # maximum share of the orders removed at once
+# Number of nearest batches (by centroid) where an order can be inserted
+ALNS_INSERTION_BATCHES = 10
+ALNS_WORST_RANDOMNESS = 3  # the higher, the more deterministic the worst removal
+ALNS_SCORES = (33, 9, 13)  # new best, improving and accepted worse solutions
+ALNS_SEGMENT = 100  # iterations between the updates of the operator weights
+ALNS_REACTION = 0.1  # weight of the last segment in the operator weights
+# At first, a 5% worse solution is accepted with probability 1/2
+ALNS_START_WORSENING = 0.05
+ALNS_COOLING_RATE = 5e-4
+ALNS_TOLERANCE = 1e-6
+
+
+class State(BaseModel):
+    """
+    Batches of a (partial) solution of the ALNS: the orders and the route of each batch,
+    with its distance, volume, number of orders and sum of the centroids of its orders.
+    """
+
+    orders: list
+    routes: list
+    distance: np.ndarray
+    load: np.ndarray
+    count: np.ndarray
+    sums: np.ndarray
+    labels: dict  # batch of each order id
+    savings: dict = {}  # removal savings of the orders of each batch, while unchanged
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def total(self) -> float:
+        return float(self.distance.sum())
+
+    def copy(self) -> "State":
+        return State(
+            orders=[list(orders) for orders in self.orders],
+            routes=[list(route) for route in self.routes],
+            distance=self.distance.copy(),
+            load=self.load.copy(),
+            count=self.count.copy(),
+            sums=self.sums.copy(),
+            labels=dict(self.labels),
+            savings=dict(self.savings),
+        )
+
+
+class ALNS(Problem):
+    """
+    # Adaptive Large Neighborhood Search
+
+    At each iteration, a destroy operator removes a few orders from their batches, and a repair operator inserts them back,
+    each one in the batch (among the nearest ones by centroid) where its cheapest insertion in the route costs the least.
+    - Destroy operators: random, worst (the orders whose removal saves the most distance) and related removal
+    (an order and its nearest orders by centroid).
+    - Repair operators: greedy insertion (the cheapest insertion first) and regret insertion
+    (the order with the largest difference between its best and second best batch first).
+    A new batch is opened for the orders that do not fit in any nearby batch.
+    The operators are selected by roulette wheel, with weights adapted every `ALNS_SEGMENT` iterations to their scores
+    (new best, improving or accepted solutions), and the new solutions are accepted by simulated annealing.
+    The routes are evaluated on the distance matrix during the search, within a wall-clock budget,
+    and the modified batches of the best solution are finally routed again.
+    """
+
+    current_solution: list[Batch]
+    routing_method: Any
+    move: Any = None
+    centroids: Any = None
+    positions: dict[int, int] = {}  # index of each order id in the centroids
+
+    @property
+    def destroy_operators(self) -> dict[str, Callable]:
+        return {
+            "random": self.random_removal,
+            "worst": self.worst_removal,
+            "related": self.related_removal,
+        }
+
+    @property
+    def repair_operators(self) -> dict[str, Callable]:
+        return {"greedy": self.greedy_insertion, "regret": self.regret_insertion}
+
+    def initialize(self) -> State:
+        matrix = self.warehouse.distances.matrix
+        self.move = InsertionMove(
+            routing_method=self.routing_method,
+            matrix=np.where(np.isnan(matrix) | (matrix < 0), 0, matrix),
+            vehicle=self.warehouse.vehicle,
+        )
+        orders = [order for batch in self.current_solution for order in batch.orders]
+        self.positions = {order.id: idx for idx, order in enumerate(orders)}
+        self.centroids = order_centroids(self.warehouse.copy(update={"orders": orders}))
+        labels = np.repeat(
+            np.arange(len(self.current_solution)),
+            [batch.nb_orders for batch in self.current_solution],
+        )
+
+        return State(
+            orders=[list(batch.orders) for batch in self.current_solution],
+            routes=[list(batch.route.sequence) for batch in self.current_solution],
+            distance=np.array(
+                [batch.metrics.distance for batch in self.current_solution], dtype=float
+            ),
+            load=np.bincount(
+                labels,
+                weights=[order.volume for order in orders],
+                minlength=len(self.current_solution),
+            ),
+            count=np.bincount(labels, minlength=len(self.current_solution)),
+            sums=np.column_stack(
+                [np.bincount(labels, weights=axis) for axis in self.centroids.T]
+            ),
+            labels={order.id: int(label) for order, label in zip(orders, labels)},
+        )
+
+    def remove(self, state: State, order: Order) -> None:
+        batch = state.labels.pop(order.id)
+        state.savings.pop(batch, None)
+        state.orders[batch] = [od for od in state.orders[batch] if od.id != order.id]
+        state.routes[batch] = self.move.remove(state.routes[batch], order)
+        state.load[batch] -= order.volume
+        state.count[batch] -= 1
+        state.sums[batch] -= self.centroids[self.positions[order.id]]
+        state.distance[batch] = (
+            self.move.length(state.routes[batch]) if state.count[batch] else 0
+        )
+
+    def insert(self, state: State, batch: int, order: Order) -> None:
+        if batch == len(state.orders):
+            state.orders.append([])
+            state.routes.append([order.depots[0], order.depots[-1]])
+            state.distance = np.append(state.distance, 0)
+            state.load = np.append(state.load, 0)
+            state.count = np.append(state.count, 0)
+            state.sums = np.vstack([state.sums, np.zeros(state.sums.shape[1])])
+
+        state.labels[order.id] = batch
+        state.savings.pop(batch, None)
+        state.orders[batch].append(order)
+        state.routes[batch] = self.move.insert(state.routes[batch], order)
+        state.load[batch] += order.volume
+        state.count[batch] += 1
+        state.sums[batch] += self.centroids[self.positions[order.id]]
+        state.distance[batch] = self.move.length(state.routes[batch])
+
+    def insertion_cost(self, state: State, order: Order, batch: int) -> float:
+        """Cost of the cheapest insertion of the order in the route of the batch (or of a new batch)."""
+        if batch < len(state.orders):
+            route, current = state.routes[batch], state.distance[batch]
+        else:
+            route, current = [order.depots[0], order.depots[-1]], 0
+        positions, _ = cheapest_insertion(
+            self.move.matrix,
+            [item.position_id for item in route],
+            [item.position_id for item in order.pickups],
+        )
+
+        return route_length(self.move.matrix, positions) - current
+
+    def insertion_costs(self, state: State, order: Order) -> dict[int, float]:
+        """
+        Cost of inserting the order in each of its nearest batches with enough capacity (and in an empty batch, if any).
+        If the order does not fit in any of them, the only option is a new batch.
+        """
+        vehicle = self.warehouse.vehicle
+        fits = (state.load + order.volume <= vehicle.max_volume) & (
+            state.count + 1 <= vehicle.max_nb_orders
+        )
+        centers = state.sums / np.maximum(state.count, 1)[:, None]
+        distances = np.linalg.norm(
+            centers - self.centroids[self.positions[order.id]], axis=1
+        )
+        distances[~fits | (state.count == 0)] = np.inf
+        nb_batches = min(ALNS_INSERTION_BATCHES, len(distances))
+        batches = list(np.argpartition(distances, nb_batches - 1)[:nb_batches])
+        batches = [int(batch) for batch in batches if np.isfinite(distances[batch])]
+        batches += [int(batch) for batch in np.flatnonzero(state.count == 0)[:1]]
+
+        return {
+            batch: self.insertion_cost(state, order, batch)
+            for batch in batches or [len(state.orders)]
+        }
+
+    def update_costs(
+        self, state: State, pending: list[Order], options: list[dict], batch: int
+    ) -> None:
+        """Update the insertion costs of the pending orders in the batch modified by the last insertion."""
+        vehicle = self.warehouse.vehicle
+
+        for order, costs in zip(pending, options):
+            if batch not in costs:
+                continue
+
+            del costs[batch]
+
+            if (
+                state.load[batch] + order.volume <= vehicle.max_volume
+                and state.count[batch] + 1 <= vehicle.max_nb_orders
+            ):
+                costs[batch] = self.insertion_cost(state, order, batch)
+            elif not costs:
+                costs.update(self.insertion_costs(state, order))
+
+    def nb_removed(self) -> int:
+        upper = min(
+            ALNS_MAX_REMOVAL,
+            max(ALNS_MIN_REMOVAL, int(ALNS_REMOVAL_SHARE * len(self.positions))),
+        )
+
+        return min(randint(ALNS_MIN_REMOVAL, upper), len(self.positions))
+
+    def random_removal(self, state: State, nb_orders: int) -> list[Order]:
+        orders = sample(
+            [order for orders in state.orders for order in orders], nb_orders
+        )
+
+        for order in orders:
+            self.remove(state, order)
+
+        return orders
+
+    def removal_savings(self, state: State, batch: int) -> list[tuple[float, Order]]:
+        """Distance saved by removing each order of the batch, if it has more than one order."""
+        if len(state.orders[batch]) < 2:
+            return []
+
+        return [
+            (
+                state.distance[batch]
+                - self.move.length(self.move.remove(state.routes[batch], order)),
+                order,
+            )
+            for order in state.orders[batch]
+        ]
+
+    def worst_removal(self, state: State, nb_orders: int) -> list[Order]:
+        """
+        Remove the orders whose removal saves the most distance, with some randomness.
+        The savings are kept for the batches that are not modified since they were computed.
+        """
+        removed = []
+
+        for _ in range(nb_orders):
+            for batch in range(len(state.orders)):
+                if batch not in state.savings:
+                    state.savings[batch] = self.removal_savings(state, batch)
+
+            savings = sorted(
+                (saving for batch in state.savings.values() for saving in batch),
+                key=lambda saving: -saving[0],
+            )
+
+            if not savings:
+                break
+
+            order = savings[int(random() ** ALNS_WORST_RANDOMNESS * len(savings))][1]
+            self.remove(state, order)
+            removed.append(order)
+
+        return removed
+
+    def related_removal(self, state: State, nb_orders: int) -> list[Order]:
+        """Remove a random order and its nearest orders, by the distance between their centroids."""
+        ids = list(state.labels)
+        indices = np.array([self.positions[order_id] for order_id in ids])
+        seed = self.centroids[indices[randint(0, len(ids) - 1)]]
+        distances = np.linalg.norm(self.centroids[indices] - seed, axis=1)
+        nearest = set(ids[idx] for idx in np.argsort(distances)[:nb_orders])
+        orders = [
+            order for orders in state.orders for order in orders if order.id in nearest
+        ]
+
+        for order in orders:
+            self.remove(state, order)
+
+        return orders
+
+    def greedy_insertion(self, state: State, orders: list[Order]) -> None:
+        """Insert the order with the cheapest insertion first."""
+        pending = list(orders)
+        options = [self.insertion_costs(state, order) for order in pending]
+
+        while pending:
+            idx = int(np.argmin([min(costs.values()) for costs in options]))
+            costs = options.pop(idx)
+            batch = min(costs, key=costs.get)
+            self.insert(state, batch, pending.pop(idx))
+            self.update_costs(state, pending, options, batch)
+
+    def regret_insertion(self, state: State, orders: list[Order]) -> None:
+        """Insert the order with the largest regret (second best minus best insertion cost) first."""
+        pending = list(orders)
+        options = [self.insertion_costs(state, order) for order in pending]
+
+        while pending:
+            regrets = []
+
+            for costs in options:
+                best, *others = sorted(costs.values())
+                regrets.append(others[0] - best if others else np.inf)
+
+            idx = int(np.argmax(regrets))
+            costs = options.pop(idx)
+            batch = min(costs, key=costs.get)
+            self.insert(state, batch, pending.pop(idx))
+            self.update_costs(state, pending, options, batch)
+
+    def select(self, weights: dict[str, float]) -> str:
+        """Roulette wheel selection of an operator."""
+        names = list(weights)
+        probabilities = np.array([weights[name] for name in names])
+
+        return names[
+            np.random.choice(len(names), p=probabilities / probabilities.sum())
+        ]
+
+    def build_solution(self, state: State) -> list[Batch]:
+        """
+        Batches of the state, where the modified ones are routed again,
+        or keep their insertion route once the deadline has expired.
+        """
+        initial = {frozenset(batch.order_ids): batch for batch in self.current_solution}
+        solution = []
+
+        for orders, route in zip(state.orders, state.routes):
+            if not orders:
+                continue
+
+            key = frozenset(order.id for order in orders)
+
+            if key in initial:
+                solution.append(initial[key])
+            elif self.deadline is not None and self.deadline.is_expired():
+                solution.append(self.move.rebuild(orders, route))
+            else:
+                solution.append(self.move.reroute(self.move.rebuild(orders, route)))
+
+        return solution
+
+    def solve(self) -> list[Batch]:
+        start = time()
+        budget = ALNS_SEARCH_SHARE * self.phase_timeout()
+        current = best = self.initialize()
+        initial_distance = current.total
+        annealing = SimmulatedAnnealing(
+            temperature=ALNS_START_WORSENING * current.total / np.log(2),
+            cooling_rate=ALNS_COOLING_RATE,
+        )
+        operators = {**self.destroy_operators, **self.repair_operators}
+        weights = {name: 1.0 for name in operators}
+        scores = {name: 0.0 for name in operators}
+        uses = {name: 0 for name in operators}
+        iteration = 0
+
+        while iteration < ALNS_MAX_ITERATIONS and time() - start < budget:
+            iteration += 1
+            destroy = self.select(
+                {name: weights[name] for name in self.destroy_operators}
+            )
+            repair = self.select(
+                {name: weights[name] for name in self.repair_operators}
+            )
+            candidate = current.copy()
+            removed = operators[destroy](candidate, self.nb_removed())
+            operators[repair](candidate, removed)
+
+            improvement = current.total - candidate.total
+            score = 0
+
+            if annealing.metropolis_criterion(improvement):
+                if candidate.total < best.total - ALNS_TOLERANCE:
+                    best, score = candidate, ALNS_SCORES[0]
+                    debug(f"ALNS | Iteration {iteration} | Best {best.total}")
+                else:
+                    score = ALNS_SCORES[1] if improvement > 0 else ALNS_SCORES[2]
+
+                current = candidate
+
+            annealing.update_temperature()
+
+            for name in (destroy, repair):
+                scores[name] += score
+                uses[name] += 1
+
+            if iteration % ALNS_SEGMENT == 0:
+                for name in operators:
+                    if uses[name]:
+                        weights[name] = (1 - ALNS_REACTION) * weights[
+                            name
+                        ] + ALNS_REACTION * scores[name] / uses[name]
+                        weights[name] = max(weights[name], ALNS_TOLERANCE)
+
+                    scores[name], uses[name] = 0.0, 0
+
+        info(
+            f"ALNS | Iterations {iteration} | Distance {round(initial_distance, 2)} -> {round(best.total, 2)} | Weights { {name: round(weight, 2) for name, weight in weights.items()} }"
+        )
+        self.report.record("alns_iterations", iteration)
+
+        return self.build_solution(best)
@@ -0,0 +1,133 @@
+import numpy as np
+from pydantic import BaseModel
+
+from domain.models.instances import Vehicle
+from domain.models.solutions import Batch
+from domain.sequential.local_search.search import mix, zobrist_key
+
+
+class Assignment(BaseModel):
+    """
+    # Assignment of the orders to the batches
+
+    Array representation of a solution: the batch of each order, and the volume and number of orders of each batch,
+    aggregated with `np.bincount` and then maintained incrementally.
+    A move is a delta (the new batch of some orders), applied in place and returning its reverse delta,
+    so that a rejected move is undone without copying the solution.
+    The capacity of the batches modified by a delta is checked before applying it, without routing them.
+    The Zobrist hash of each batch and of the solution (see `TabuSearch`) are also maintained,
+    so that the hash of the solution after a delta is computed from the moved orders only, for the tabu checks.
+    """
+
+    index: dict[int, int]  # index of each order id in the arrays
+    labels: np.ndarray  # batch of each order
+    volumes: np.ndarray  # volume of each order
+    load: np.ndarray  # volume of each batch
+    count: np.ndarray  # number of orders of each batch
+    keys: list[int]  # Zobrist key of each order
+    batch_hashes: list[int]  # XOR of the keys of the orders of each batch
+    value: int  # hash of the solution
+    vehicle: Vehicle
+
+    class Config:
+        arbitrary_types_allowed = True
+        copy_on_model_validation = "none"  # the operators share the same assignment
+
+    @classmethod
+    def from_solution(cls, solution: list[Batch], vehicle: Vehicle) -> "Assignment":
+        orders = [order for batch in solution for order in batch.orders]
+        labels = np.repeat(np.arange(len(solution)), [b.nb_orders for b in solution])
+        volumes = np.array([order.volume for order in orders], dtype=float)
+        keys = [zobrist_key(order.id) for order in orders]
+        batch_hashes = [0] * len(solution)
+
+        for label, key in zip(labels.tolist(), keys):
+            batch_hashes[label] ^= key
+
+        value = 0
+
+        for batch_hash in batch_hashes:
+            value ^= mix(batch_hash)
+
+        return cls(
+            index={order.id: idx for idx, order in enumerate(orders)},
+            labels=labels,
+            volumes=volumes,
+            load=np.bincount(labels, weights=volumes, minlength=len(solution)),
+            count=np.bincount(labels, minlength=len(solution)),
+            keys=keys,
+            batch_hashes=batch_hashes,
+            value=value,
+            vehicle=vehicle,
+        )
+
+    def relocate(self, order_id: int, batch: int) -> dict[int, int]:
+        return {self.index[order_id]: batch}
+
+    def swap(self, order_id_1: int, order_id_2: int) -> dict[int, int]:
+        idx_1, idx_2 = self.index[order_id_1], self.index[order_id_2]
+
+        return {idx_1: int(self.labels[idx_2]), idx_2: int(self.labels[idx_1])}
+
+    def aggregates(self, delta: dict[int, int]) -> tuple[np.ndarray, ...]:
+        """Batches modified by the delta, and the change of their volume and number of orders."""
+        orders = np.fromiter(delta.keys(), dtype=int, count=len(delta))
+        targets = np.fromiter(delta.values(), dtype=int, count=len(delta))
+        batches, inverse = np.unique(
+            np.concatenate([self.labels[orders], targets]), return_inverse=True
+        )
+        signs = np.repeat([-1, 1], len(delta))
+        volumes = np.tile(self.volumes[orders], 2)
+
+        return (
+            batches,
+            np.bincount(inverse, weights=signs * volumes, minlength=len(batches)),
+            np.bincount(inverse, weights=signs, minlength=len(batches)),
+        )
+
+    def is_feasible(self, delta: dict[int, int]) -> bool:
+        """Whether the batches that receive orders with the delta still fit in the vehicle."""
+        batches, load, count = self.aggregates(delta)
+        fits = (self.load[batches] + load <= self.vehicle.max_volume) & (
+            self.count[batches] + count <= self.vehicle.max_nb_orders
+        )
+
+        return bool(np.all(fits | ((load <= 0) & (count <= 0))))
+
+    def batch_changes(self, delta: dict[int, int]) -> dict[int, int]:
+        """New hash of the batches modified by the delta."""
+        changes = {}
+
+        for order, target in delta.items():
+            source = int(self.labels[order])
+
+            if source != target:
+                for batch in (source, target):
+                    batch_hash = changes.get(batch, self.batch_hashes[batch])
+                    changes[batch] = batch_hash ^ self.keys[order]
+
+        return changes
+
+    def hash(self, delta: dict[int, int]) -> int:
+        """Hash of the solution after the delta, in O(|delta|)."""
+        value = self.value
+
+        for batch, batch_hash in self.batch_changes(delta).items():
+            value ^= mix(self.batch_hashes[batch]) ^ mix(batch_hash)
+
+        return value
+
+    def apply(self, delta: dict[int, int]) -> dict[int, int]:
+        """Apply the delta in place, and return the delta that reverts it."""
+        reverse = {order: int(self.labels[order]) for order in delta}
+        batches, load, count = self.aggregates(delta)
+        self.load[batches] += load
+        self.count[batches] += count.astype(int)
+
+        for batch, batch_hash in self.batch_changes(delta).items():
+            self.value ^= mix(self.batch_hashes[batch]) ^ mix(batch_hash)
+            self.batch_hashes[batch] = batch_hash
+
+        self.labels[list(delta)] = list(delta.values())
+
+        return reverse
@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import numpy as np
+from pydantic import BaseModel
+
+CHUNKS_PER_WORKER = 2  # to balance the candidate moves between the processes
+
+
+def route_length(matrix: np.ndarray, positions: list[int]) -> float:
+    return float(matrix[positions[:-1], positions[1:]].sum())
+
+
+def cheapest_insertion(
+    matrix: np.ndarray, positions: list[int], inserted: list[int]
+) -> tuple[list[int], list[int]]:
+    """Route with the positions inserted one by one at their cheapest place (keeping both ends), and the index of each insertion."""
+    positions, slots = list(positions), []
+
+    for position in inserted:
+        route = np.array(positions)
+        costs = (
+            matrix[route[:-1], position]
+            + matrix[position, route[1:]]
+            - matrix[route[:-1], route[1:]]
+        )
+        slots.append(int(np.argmin(costs)) + 1)
+        positions.insert(slots[-1], position)
+
+    return positions, slots
+
+
+def move_delta(matrix: np.ndarray, changes: list[tuple]) -> float:
+    """
+    Change of distance of a move, given for each modified batch the route without the removed order,
+    the positions of the inserted order and the current distance of the batch.
+    """
+    delta = 0
+
+    for positions, inserted, distance in changes:
+        positions, _ = cheapest_insertion(matrix, positions, inserted)
+        delta += route_length(matrix, positions) - distance
+
+    return delta
+
+
+_worker = {}  # state of the worker processes, set by `init_worker`
+
+
+def init_worker(name: str, shape: tuple) -> None:
+    """Attach the worker process to the shared distance matrix."""
+    memory = SharedMemory(name=name)
+    _worker.update(
+        memory=memory, matrix=np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    )
+
+
+def evaluate_moves(moves: list[list[tuple]]) -> list[float]:
+    """Evaluate a chunk of candidate moves in a worker process."""
+    return [move_delta(_worker["matrix"], changes) for changes in moves]
+
+
+class Neighborhood(BaseModel):
+    """
+    # Neighborhood evaluation
+
+    Evaluation of a sample of candidate moves by their insertion deltas.
+    With several workers, the moves are split in chunks evaluated by a pool of processes,
+    which read the distance matrix from shared memory instead of receiving a copy with each chunk.
+    The pool is started and released as a context manager, for the whole local search.
+    """
+
+    matrix: np.ndarray
+    nb_workers: int = 1
+    memory: Any = None
+    executor: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+        copy_on_model_validation = "none"  # the operators share the started pool
+
+    def __enter__(self) -> "Neighborhood":
+        if self.nb_workers > 1:
+            self.memory = SharedMemory(create=True, size=self.matrix.size * 8)
+            shared = np.ndarray(
+                self.matrix.shape, dtype=np.float64, buffer=self.memory.buf
+            )
+            shared[:] = self.matrix
+            del shared  # release the buffer before closing the shared memory
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.nb_workers,
+                initializer=init_worker,
+                initargs=(self.memory.name, self.matrix.shape),
+            )
+
+        return self
+
+    def __exit__(self, *_) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.memory.close()
+            self.memory.unlink()
+            self.executor, self.memory = None, None
+
+    def evaluate(self, moves: list[list[tuple]]) -> list[float]:
+        """Change of distance of each candidate move (see `move_delta`)."""
+        if self.executor is None:
+            return [move_delta(self.matrix, changes) for changes in moves]
+
+        nb_chunks = min(len(moves), self.nb_workers * CHUNKS_PER_WORKER)
+        bounds = np.linspace(0, len(moves), nb_chunks + 1).astype(int)
+        chunks = [moves[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        return [
+            delta
+            for deltas in self.executor.map(evaluate_moves, chunks)
+            for delta in deltas
+        ]
@@ -1,9 +1,20 @@
-from random import choice
-from typing import Any
+from logging import debug
+from random import choice, randrange, sample
+from typing import Any, Optional
 
+import numpy as np
 from pydantic import BaseModel
 
-from domain.models.solutions import Batch
+from domain.models.instances import Item, Order
+from domain.models.solutions import Batch, Metrics, Route
+from domain.sequential.local_search.assignment import Assignment
+from domain.sequential.local_search.neighborhood import (
+    Neighborhood,
+    cheapest_insertion,
+    route_length,
+)
+
+MOVE_CANDIDATES = 10  # candidate moves scored by the route estimator
 
 
 def validate_move(func):
@@ -21,12 +32,21 @@ class Move(BaseModel):
     """Generic move for the local search."""
 
     routing_method: Any = None
+    estimator: Any = None
+    matrix: Any = None  # walking distances between the positions
+    vehicle: Any = None
 
     @validate_move
     def apply(self, _: list[Batch]) -> list[Batch]:
         """Apply the move to the solution and return the new solution."""
         raise NotImplementedError
 
+    def estimate(self, orders: list) -> float:
+        """Estimated route length of a batch with the given orders."""
+        positions = [item.position_id for order in orders for item in order.pickups]
+
+        return self.estimator.estimate(positions)
+
     def route(self, batch: Batch) -> Batch:
         """Route the batch."""
         routes = self.routing_method("VRP", [batch])
@@ -34,30 +54,96 @@ class Move(BaseModel):
 
         return routes[0]
 
+    def length(self, sequence: list[Item]) -> float:
+        return route_length(self.matrix, [item.position_id for item in sequence])
+
+    def remove(self, sequence: list[Item], order: Order) -> list[Item]:
+        """Route without the pick-up items of the order, keeping the depots at both ends."""
+        item_ids = {item.id for item in order.pickups}
+        inner = [item for item in sequence[1:-1] if item.id not in item_ids]
+
+        return sequence[:1] + inner + sequence[-1:]
+
+    def insert(self, sequence: list[Item], order: Order) -> list[Item]:
+        """Route with the pick-up items of the order inserted one by one at their cheapest position."""
+        sequence = list(sequence)
+        _, slots = cheapest_insertion(
+            self.matrix,
+            [item.position_id for item in sequence],
+            [item.position_id for item in order.pickups],
+        )
+
+        for item, slot in zip(order.pickups, slots):
+            sequence.insert(slot, item)
+
+        return sequence
+
+    def rebuild(self, orders: list[Order], sequence: list[Item]) -> Batch:
+        """Batch with the given route, whose metrics are evaluated on the distance matrix."""
+        metrics = Metrics(
+            distance=self.length(sequence),
+            units=len(orders),
+            volume=sum(order.volume for order in orders),
+        )
+
+        return Batch(orders=orders, route=Route(sequence=sequence), metrics=metrics)
+
 
 class Swap(Move):
     """
     # Swap move
 
-    Select two random orders from two different batches and swap them.
+    Select two orders from two different batches and swap them.
+    If a route estimator is given, the swap with the best estimated change among `MOVE_CANDIDATES` random ones is selected.
     Both new batches are routed again.
     """
 
+    def delta(self, source: Batch, destination: Batch, swap: tuple) -> float:
+        """Estimated change of the route length of both batches after swapping the orders."""
+        order_source, order_destination = swap
+        new_source = [od for od in source.orders if od != order_source]
+        new_destination = [od for od in destination.orders if od != order_destination]
+
+        return (
+            self.estimate(new_source + [order_destination])
+            + self.estimate(new_destination + [order_source])
+            - self.estimate(source.orders)
+            - self.estimate(destination.orders)
+        )
+
     @validate_move
     def apply(self, solution: list[Batch]) -> list[Batch]:
-        source, destination = choice(solution), choice(solution)
-        order_source, order_destination = choice(source.orders), choice(
-            destination.orders
-        )
+        if len(solution) < 2:
+            return solution
 
-        source.orders.remove(order_source)
-        destination.orders.remove(order_destination)
+        nb_candidates = MOVE_CANDIDATES if self.estimator is not None else 1
+        candidates = []
 
-        source.orders.append(order_destination)
-        destination.orders.append(order_source)
+        for _ in range(nb_candidates):
+            source, destination = sample(range(len(solution)), 2)
+            swap = (
+                choice(solution[source].orders),
+                choice(solution[destination].orders),
+            )
+            candidates.append((source, destination, swap))
 
-        source = self.route(source)
-        destination = self.route(destination)
+        if self.estimator is not None:
+            candidates.sort(
+                key=lambda candidate: self.delta(
+                    solution[candidate[0]], solution[candidate[1]], candidate[2]
+                )
+            )
+
+        source, destination, (order_source, order_destination) = candidates[0]
+
+        solution[source].orders.remove(order_source)
+        solution[destination].orders.remove(order_destination)
+
+        solution[source].orders.append(order_destination)
+        solution[destination].orders.append(order_source)
+
+        solution[source] = self.route(solution[source])
+        solution[destination] = self.route(solution[destination])
 
         return solution
 
@@ -66,7 +152,8 @@ class Relocate(Move):
     """
     # Relocate move
 
-    Select a random order from the least loaded batch and relocate it to another randomly selected batch from the p50 least loaded batches.
+    Select a random order from the least loaded batch and relocate it to another batch from the p50 least loaded batches,
+    the one with the least estimated insertion cost if a route estimator is given (otherwise, randomly selected).
     The new batch is routed again, whereas the previous batch is just updated without the items of the relocated order.
     Criteria: Prioritize the batches with single orders.
     """
@@ -80,14 +167,212 @@ class Relocate(Move):
         order = choice(source.orders)
         source.orders.remove(order)
 
-        # Select the destination batch and route the new batch
-        candidates = solution[: len(solution) // 2]
-        destination = choice(candidates)
+        # Select the destination batch (the least estimated insertion cost, if available) and route the new batch
+        candidates = solution[: max(len(solution) // 2, 1)]
+
+        if self.estimator is not None:
+            destination = min(
+                candidates,
+                key=lambda batch: self.estimate(batch.orders + [order])
+                - self.estimate(batch.orders),
+            )
+
+        else:
+            destination = choice(candidates)
+
         solution.remove(destination)
         destination.orders.append(order)
         destination = self.route(destination)
 
+        if self.matrix is not None:
+            source = self.rebuild(
+                source.orders, self.remove(source.route.sequence, order)
+            )
+
         # Update the solution with both modified batches
         solution.extend([source, destination])
 
         return solution
+
+
+class InsertionMove(Move):
+    """
+    # Insertion move
+
+    Move evaluated by removal and cheapest-insertion deltas on the current routes, instead of routing the new batches.
+    Among `nb_candidates` random candidates, the capacity-feasible one with the smallest change of distance
+    (and not tabu, if `is_tabu` is given, checked on the hash of the assignment after the move) is selected,
+    and only the modified batches of the selected move are built, with their insertion routes.
+    The capacity is checked on the `assignment` of the orders to the batches, where the selected move is applied
+    until it is rejected (see `reject`). The candidates are evaluated by the `neighborhood` (possibly in parallel processes).
+    Only the accepted moves are routed again (see `reroute`).
+    """
+
+    assignment: Optional[Assignment] = None
+    neighborhood: Optional[Neighborhood] = None
+    is_tabu: Any = None
+    nb_candidates: int = MOVE_CANDIDATES
+    reverse: dict[int, int] = {}  # delta that reverts the last applied move
+
+    def candidates(self, solution: list[Batch]) -> list[tuple]:
+        raise NotImplementedError
+
+    def evaluate(self, solution: list[Batch], candidate: tuple) -> Optional[tuple]:
+        """
+        Assignment delta and new batches (by index in the solution) of the candidate move, if it is feasible:
+        their orders, their route without the removed order, and the order to insert (if any).
+        """
+        raise NotImplementedError
+
+    def other_batch(self, solution: list[Batch], batch: int) -> int:
+        other = randrange(len(solution) - 1)
+
+        return other + 1 if other >= batch else other
+
+    def changes(self, solution: list[Batch], move: dict[int, tuple]) -> list[tuple]:
+        """Positions of the modified routes and inserted orders of a move, to evaluate it (see `move_delta`)."""
+        return [
+            (
+                [item.position_id for item in sequence],
+                [item.position_id for item in inserted.pickups] if inserted else [],
+                solution[idx].metrics.distance,
+            )
+            for idx, (_, sequence, inserted) in move.items()
+        ]
+
+    @validate_move
+    def apply(self, solution: list[Batch]) -> list[Batch]:
+        moves = [
+            move
+            for candidate in self.candidates(solution)
+            if (move := self.evaluate(solution, candidate)) is not None
+        ]
+        neighborhood = self.neighborhood or Neighborhood(matrix=self.matrix)
+        deltas = neighborhood.evaluate(
+            [self.changes(solution, batches) for _, batches in moves]
+        )
+        self.reverse = {}
+
+        for rank in np.argsort(deltas, kind="stable"):
+            delta, batches = moves[rank]
+
+            if self.is_tabu is not None and self.is_tabu(self.assignment.hash(delta)):
+                continue
+
+            new_solution = list(solution)
+
+            for idx, (orders, sequence, inserted) in batches.items():
+                if inserted is not None:
+                    sequence = self.insert(sequence, inserted)
+
+                new_solution[idx] = self.rebuild(orders, sequence)
+
+            self.reverse = self.assignment.apply(delta)
+
+            return new_solution
+
+        return list(solution)
+
+    def reject(self) -> None:
+        """Revert the last applied move in the assignment."""
+        self.assignment.apply(self.reverse)
+        self.reverse = {}
+
+    def reroute(self, batch: Batch) -> Batch:
+        """Route the batch of an accepted move, keeping its insertion route if it is shorter (or if the routing fails)."""
+        try:
+            routed = self.route(batch)
+        except ValueError as err:
+            debug(f"Insertion move | Routing failed, insertion route kept: {err}")
+            return batch
+
+        return routed if routed.metrics.distance < batch.metrics.distance else batch
+
+
+class InsertionRelocate(InsertionMove):
+    """
+    # Relocate move (insertion)
+
+    Relocate a random order of a batch with several orders to another random batch.
+    The order is removed from the route of its batch and inserted in the route of the other one.
+    """
+
+    def candidates(self, solution: list[Batch]) -> list[tuple]:
+        sources = np.flatnonzero(self.assignment.count > 1)
+
+        if len(sources) == 0 or len(solution) < 2:
+            return []
+
+        candidates = []
+
+        for _ in range(self.nb_candidates):
+            source = int(choice(sources))
+            destination = self.other_batch(solution, source)
+            candidates.append((source, destination, choice(solution[source].orders)))
+
+        return candidates
+
+    def evaluate(self, solution: list[Batch], candidate: tuple) -> Optional[tuple]:
+        source, destination, order = candidate
+        delta = self.assignment.relocate(order.id, destination)
+
+        if not self.assignment.is_feasible(delta):
+            return None
+
+        return delta, {
+            source: (
+                [od for od in solution[source].orders if od.id != order.id],
+                self.remove(solution[source].route.sequence, order),
+                None,
+            ),
+            destination: (
+                solution[destination].orders + [order],
+                solution[destination].route.sequence,
+                order,
+            ),
+        }
+
+
+class InsertionSwap(InsertionMove):
+    """
+    # Swap move (insertion)
+
+    Swap two random orders of two different batches.
+    Each order is removed from the route of its batch and inserted in the route of the other one.
+    """
+
+    def candidates(self, solution: list[Batch]) -> list[tuple]:
+        if len(solution) < 2:
+            return []
+
+        candidates = []
+
+        for _ in range(self.nb_candidates):
+            source = randrange(len(solution))
+            destination = self.other_batch(solution, source)
+            swap = (
+                choice(solution[source].orders),
+                choice(solution[destination].orders),
+            )
+            candidates.append((source, destination, swap))
+
+        return candidates
+
+    def evaluate(self, solution: list[Batch], candidate: tuple) -> Optional[tuple]:
+        source, destination, (order_source, order_destination) = candidate
+        delta = self.assignment.swap(order_source.id, order_destination.id)
+
+        if not self.assignment.is_feasible(delta):
+            return None
+
+        batches = {}
+
+        for idx, removed, inserted in [
+            (source, order_source, order_destination),
+            (destination, order_destination, order_source),
+        ]:
+            orders = [od for od in solution[idx].orders if od.id != removed.id]
+            sequence = self.remove(solution[idx].route.sequence, removed)
+            batches[idx] = (orders + [inserted], sequence, inserted)
+
+        return delta, batches
@@ -1,3 +1,6 @@
+from collections import deque
+from functools import lru_cache
+
 import numpy as np
 from pydantic import BaseModel
 
@@ -6,6 +9,22 @@ from domain.models.solutions import Batch
 SA_INITAL_TEMPERATURE = 100.0
 SA_COOLING_RATE = 0.003
 TS_MEMORY_SIZE = 10
+HASH_MASK = 2**64 - 1
+
+
+def mix(value: int) -> int:
+    """SplitMix64 finalizer, to spread the bits of a 64-bit integer."""
+    value = (value + 0x9E3779B97F4A7C15) & HASH_MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+
+    return value ^ (value >> 31)
+
+
+@lru_cache(maxsize=None)
+def zobrist_key(order_id: int) -> int:
+    """Pseudo-random 64-bit key of an order."""
+    return mix(order_id)
 
 
 class SimmulatedAnnealing(BaseModel):
@@ -22,7 +41,7 @@ class SimmulatedAnnealing(BaseModel):
         self.temperature *= 1 - self.cooling_rate
 
     def acceptance_probability(self, improvement: float) -> float:
-        return np.exp(-improvement / self.temperature)
+        return np.exp(improvement / self.temperature)
 
     def metropolis_criterion(self, improvement: float) -> bool:
         """Accept the new solution if it is better than the current solution or using the Metropolis criterion."""
@@ -37,24 +56,42 @@ class TabuSearch(BaseModel):
 
     To avoid cycling through the same solutions, the Tabu Search adaptative memory is used to store properties of the solutions that are forbidden to be selected again.
     This memory is adjusted during the search process to force the algorithm to explore different regions of the search space (diversification).
+    The solutions are stored as Zobrist hashes of their batches: each order has a pseudo-random 64-bit key, a batch is hashed by the XOR of the keys of its orders,
+    and a solution by the XOR of its (mixed) batch hashes, regardless of the order of the batches.
+    The hashes are kept in a bounded queue (the tabu tenure) and in a set, for constant-time tabu checks.
+    The hash of a solution is either computed from its batches (`hash`) or maintained incrementally by the moves
+    (see `Assignment`), and the memory is queried and updated with the hash values.
     """
 
     memory_size: int = TS_MEMORY_SIZE
-    memory: list[dict] = []
+    memory: deque = deque()
+    hashes: set[int] = set()
 
-    def update_memory(self, solution: list[Batch], to_diversify: bool):
+    def hash(self, solution: list[Batch]) -> int:
+        value = 0
+
+        for batch in solution:
+            batch_hash = 0
+
+            for order in batch.orders:
+                batch_hash ^= zobrist_key(order.id)
+
+            value ^= mix(batch_hash)
+
+        return value
+
+    def update_memory(self, value: int, to_diversify: bool):
         """
-        Update the tabu memory with the representation of the new solution.
-        A solution is represented by a dictionary that maps the batch id to the list of order ids.
+        Update the tabu memory with the hash of the new solution, forgetting the oldest ones beyond the memory size
+        (half of it to diversify the search).
         """
-        self.memory.append({batch.id: batch.orders for batch in solution})
+        self.memory.append(value)
+        self.hashes.add(value)
+        size = self.memory_size // 2 if to_diversify else self.memory_size
 
-        if to_diversify:
-            self.memory = self.memory[-self.memory_size // 2 :]
+        while len(self.memory) > size:
+            self.hashes.discard(self.memory.popleft())
 
-    def is_tabu(self, solution: list[Batch]) -> bool:
-        """A movement is tabu if all batches have the same order ids."""
-        return any(
-            all(batch.orders == tabu[batch.id] for batch in solution)
-            for tabu in self.memory
-        )
+    def is_tabu(self, value: int) -> bool:
+        """A movement is tabu if the hash of its solution (the same batches of orders) is in the memory."""
+        return value in self.hashes
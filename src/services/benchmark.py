@@ -17,6 +17,7 @@ class Benchmark(IO):
     instance_names: list[str]
     method: str
     timeout: int
+    options: dict = {}
     results: Any = None
 
     @property
@@ -29,7 +30,9 @@ class Benchmark(IO):
             if instance_name in INVALID_INSTANCES:
                 continue
 
-            BatchPicking.optimize(self.method, instance_name, self.timeout)
+            BatchPicking.optimize(
+                self.method, instance_name, self.timeout, **self.options
+            )
 
     def preprocess(self) -> None:
         """Preprocess the results of the benchmark."""
@@ -0,0 +1,113 @@
+import pickle
+from hashlib import sha256
+from logging import info
+from os import getpid, listdir, makedirs, path, remove, replace, utime
+from typing import Any, Optional
+
+import numpy as np
+
+from domain.models.instances import Warehouse
+from services.io import IO
+
+CACHE_FOLDER = path.join("outputs", ".cache")
+CACHE_MAX_SIZE = 2 * 1024**3  # bytes (2 GB)
+
+
+class MatrixCache(IO):
+    """
+    # On-disk cache of order matrices
+
+    The matrices are stored as `.npy` files keyed by a fingerprint of the instance (distances and order positions) and the metric.
+    The least recently used files are evicted when the total size of the cache exceeds `CACHE_MAX_SIZE`.
+    """
+
+    max_size: int = CACHE_MAX_SIZE
+
+    @property
+    def folder(self) -> str:
+        return path.join(self.directory, CACHE_FOLDER)
+
+    def filename(self, key: str) -> str:
+        return path.join(self.folder, f"{key}.npy")
+
+    def fingerprint(self, warehouse: Warehouse, metric: str) -> str:
+        """Hash of the data that determines the matrix, so that renamed or modified instances are not confused."""
+        digest = sha256(metric.encode())
+        digest.update(np.ascontiguousarray(warehouse.distances.matrix).tobytes())
+
+        for order in warehouse.orders:
+            digest.update(np.array(order.position_ids + [-1]).tobytes())
+
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        filename = self.filename(key)
+
+        if not path.exists(filename):
+            return None
+
+        utime(filename)  # mark as recently used
+        info(f"MatrixCache | Hit {key[:12]}")
+
+        return np.load(filename)
+
+    def save(self, key: str, matrix: np.ndarray) -> None:
+        makedirs(self.folder, exist_ok=True)
+        temporary = self.filename(f"{key}.{getpid()}")
+        np.save(temporary, matrix)
+        replace(temporary, self.filename(key))  # atomic, for concurrent experiments
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used files until the cache fits in the maximum size."""
+        files = [path.join(self.folder, file) for file in listdir(self.folder)]
+        files = sorted(files, key=path.getmtime, reverse=True)
+        size = 0
+
+        for file in files:
+            size += path.getsize(file)
+
+            if size > self.max_size:
+                info(f"MatrixCache | Evict {path.basename(file)}")
+                remove(file)
+
+
+class ColumnCache(MatrixCache):
+    """
+    # On-disk cache of batching columns
+
+    The columns (batches of orders) and their route costs are stored in a pickle file per warehouse layout (distances) and route estimator.
+    The route costs, keyed by the positions of the batch, are shared by all the instances of the same warehouse,
+    whereas the columns are kept per instance (fingerprint) to warm-start the next runs.
+    """
+
+    def filename(self, key: str) -> str:
+        return path.join(self.folder, f"{key}.pkl")
+
+    def layout(self, warehouse: Warehouse, estimator: str) -> str:
+        digest = sha256(f"columns-{estimator}".encode())
+        digest.update(np.ascontiguousarray(warehouse.distances.matrix).tobytes())
+
+        return digest.hexdigest()
+
+    def load(self, key: str) -> dict[str, Any]:
+        filename = self.filename(key)
+
+        if not path.exists(filename):
+            return {"costs": {}, "columns": {}}
+
+        utime(filename)
+        info(f"ColumnCache | Hit {key[:12]}")
+
+        with open(filename, "rb") as file:
+            return pickle.load(file)
+
+    def save(self, key: str, data: dict[str, Any]) -> None:
+        makedirs(self.folder, exist_ok=True)
+        temporary = f"{self.filename(key)}.{getpid()}"
+
+        with open(temporary, "wb") as file:
+            pickle.dump(data, file)
+
+        replace(temporary, self.filename(key))
+        self.evict()
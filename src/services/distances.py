@@ -1,7 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+
 import numpy as np
+from scipy.linalg import eigh
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import eigsh
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import directed_hausdorff
 
-from domain.models.instances import Order
+from domain.models.instances import Order, Warehouse
+
+BLOCK_MAX_ENTRIES = 2**22  # maximum number of item pairs evaluated at once
+BLOCKS_PER_WORKER = 4  # to balance the (decreasing) size of the upper triangle blocks
+PARALLEL_MIN_ORDERS = 1000
 
 
 class Hausdorff:
@@ -31,13 +43,338 @@ class Hausdorff:
 
         return max(distance_1_2, distance_2_1)
 
-    def build_matrix(self, orders: list[Order]) -> np.ndarray:
+    def build_matrix(self, warehouse: Warehouse) -> np.ndarray:
         """Build the Hausdorff distance matrix between the orders."""
+        orders = warehouse.orders
         matrix = np.zeros((len(orders), len(orders)))
 
         for i, order_i in enumerate(orders):
-            for j, order_j in enumerate(orders):
-                if i != j:
-                    matrix[i, j] = self.closeness(order_i, order_j)
+            for j in range(i + 1, len(orders)):
+                matrix[i, j] = matrix[j, i] = self.closeness(order_i, orders[j])
 
         return matrix
+
+
+def hausdorff_block(
+    matrix: np.ndarray, items: np.ndarray, offsets: np.ndarray, start: int, end: int
+) -> np.ndarray:
+    """Hausdorff distances between the orders of a block [start, end) and the orders from `start` onwards (upper triangle)."""
+    rows = items[offsets[start] : offsets[end]]
+    columns = items[offsets[start] :]
+    distances = matrix[np.ix_(rows, columns)]
+    distances = np.where(np.isnan(distances) | (distances < 0), 0, distances)
+    row_offsets = offsets[start:end] - offsets[start]
+    column_offsets = offsets[start:-1] - offsets[start]
+
+    # Directed distance from the orders of the block to the following orders
+    nearest = np.minimum.reduceat(distances, column_offsets, axis=1)
+    forward = np.maximum.reduceat(nearest, row_offsets, axis=0)
+
+    # Directed distance from the following orders to the orders of the block
+    nearest = np.minimum.reduceat(distances, row_offsets, axis=0)
+    backward = np.maximum.reduceat(nearest, column_offsets, axis=1)
+
+    return np.triu(np.maximum(forward, backward), k=1)
+
+
+_worker = {}  # state of the worker processes, set by `init_worker`
+
+
+def init_worker(
+    name: str, shape: tuple, matrix: np.ndarray, items: np.ndarray, offsets: np.ndarray
+) -> None:
+    """Attach the worker process to the shared result matrix."""
+    memory = SharedMemory(name=name)
+    _worker.update(
+        memory=memory,
+        result=np.ndarray(shape, dtype=np.float64, buffer=memory.buf),
+        matrix=matrix,
+        items=items,
+        offsets=offsets,
+    )
+
+
+def fill_block(start: int, end: int) -> None:
+    """Compute a block of the matrix in a worker process, writing it into the shared result matrix."""
+    block = hausdorff_block(
+        _worker["matrix"], _worker["items"], _worker["offsets"], start, end
+    )
+    _worker["result"][start:end, start:] = block
+
+
+class NetworkHausdorff:
+    """
+    # Network Hausdorff distance
+
+    Hausdorff distance between the pick-up items of two orders, measured with the walking distances of the warehouse instead of the Euclidean distances.
+    The items of all the orders are concatenated in a single array, where the items of each order are delimited by (CSR) offsets.
+    For a block of orders, the distances between their items and the items of the following orders are evaluated at once,
+    and the directed distances in both directions are obtained by min-max reductions over the offsets.
+    For large instances, the blocks are spread over a pool of processes that write into a shared memory matrix.
+    """
+
+    def get_positions(self, warehouse: Warehouse) -> tuple[np.ndarray, np.ndarray]:
+        """Position of the pick-up items of all the orders, and the offsets of each order in the array."""
+        sizes = [len(order.pickups) for order in warehouse.orders]
+        assert min(sizes) > 0, "Orders without pick-up items"
+
+        items = np.array(
+            [item.position_id for order in warehouse.orders for item in order.pickups]
+        )
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+        return items, offsets
+
+    def get_blocks(
+        self, offsets: np.ndarray, nb_blocks: int = 1
+    ) -> list[tuple[int, int]]:
+        """
+        Consecutive blocks of orders such that the distances of each block fit in `BLOCK_MAX_ENTRIES`,
+        with at least `nb_blocks` blocks (as far as possible) to balance the work between the processes.
+        """
+        max_items = max(
+            1, min(BLOCK_MAX_ENTRIES // offsets[-1], offsets[-1] // nb_blocks)
+        )
+        blocks, start = [], 0
+
+        while start < len(offsets) - 1:
+            end = start + 1
+
+            while (
+                end < len(offsets) - 1
+                and offsets[end + 1] - offsets[start] <= max_items
+            ):
+                end += 1
+
+            blocks.append((start, end))
+            start = end
+
+        return blocks
+
+    def build_parallel(
+        self,
+        matrix: np.ndarray,
+        items: np.ndarray,
+        offsets: np.ndarray,
+        nb_workers: int,
+    ) -> np.ndarray:
+        """Compute the blocks in parallel processes, writing the upper triangle into shared memory."""
+        shape = (len(offsets) - 1, len(offsets) - 1)
+        blocks = self.get_blocks(offsets, nb_workers * BLOCKS_PER_WORKER)
+        memory = SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+
+        try:
+            shared = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+            shared[:] = 0
+
+            with ProcessPoolExecutor(
+                max_workers=nb_workers,
+                initializer=init_worker,
+                initargs=(memory.name, shape, matrix, items, offsets),
+            ) as executor:
+                list(executor.map(fill_block, *zip(*blocks)))
+
+            result = shared.copy()
+            del shared  # release the buffer before closing the shared memory
+
+        finally:
+            memory.close()
+            memory.unlink()
+
+        return result
+
+    def build_matrix(self, warehouse: Warehouse) -> np.ndarray:
+        """Build the symmetric Hausdorff distance matrix between the orders, filling the upper triangle block by block."""
+        items, offsets = self.get_positions(warehouse)
+        distances = warehouse.distances.matrix
+        nb_workers = cpu_count() or 1
+
+        if nb_workers > 1 and warehouse.nb_orders >= PARALLEL_MIN_ORDERS:
+            matrix = self.build_parallel(distances, items, offsets, nb_workers)
+
+        else:
+            matrix = np.zeros((len(offsets) - 1, len(offsets) - 1))
+
+            for start, end in self.get_blocks(offsets):
+                matrix[start:end, start:] = hausdorff_block(
+                    distances, items, offsets, start, end
+                )
+
+        return matrix + matrix.T
+
+
+class PositionJaccard:
+    """
+    # Position Jaccard distance
+
+    One minus the Jaccard similarity between the sets of positions visited by two orders (shared positions over visited positions).
+    The orders are rows of a sparse binary incidence matrix, so that the shared positions of all the pairs
+    come from a single sparse product, in O(nnz) instead of the O(|Oi|·|Oj|) item distances of each pair.
+    The candidate pairs of orders are the most similar ones in the same sparse product (see `nearest_pairs`),
+    instead of the nearest centroids only, which would miss the orders sharing aisles far from their centroids.
+    """
+
+    def get_incidence(self, warehouse: Warehouse) -> csr_matrix:
+        """Sparse binary matrix of the positions (columns) visited by each order (rows)."""
+        rows = [i for i, order in enumerate(warehouse.orders) for _ in order.pickups]
+        columns = [
+            item.position_id for order in warehouse.orders for item in order.pickups
+        ]
+        incidence = csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(warehouse.nb_orders, len(warehouse.distances.matrix)),
+        )
+        incidence.data[:] = 1  # repeated positions are counted once
+
+        return incidence
+
+    def build_matrix(self, warehouse: Warehouse) -> np.ndarray:
+        incidence = self.get_incidence(warehouse)
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+        shared = (incidence @ incidence.T).toarray()
+        union = sizes[:, None] + sizes[None, :] - shared
+        matrix = 1 - np.divide(
+            shared, union, out=np.zeros_like(shared), where=union > 0
+        )
+        np.fill_diagonal(matrix, 0)
+
+        return matrix
+
+    def nearest_pairs(
+        self, warehouse: Warehouse, nb_neighbors: int
+    ) -> list[tuple[int, int]]:
+        """
+        Pairs of orders (i < j) sharing positions, where one order is among the `nb_neighbors` most similar orders of the other.
+        The orders with fewer than `nb_neighbors` partners are completed with their nearest orders by centroid,
+        so that the orders sharing nothing with the others can still be batched.
+        """
+        incidence = self.get_incidence(warehouse)
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+        shared = (incidence @ incidence.T).tocsr()
+        shared.setdiag(0)
+        shared.eliminate_zeros()
+        partners = [set() for _ in range(shared.shape[0])]
+
+        for i in range(shared.shape[0]):
+            start, end = shared.indptr[i], shared.indptr[i + 1]
+            columns, counts = shared.indices[start:end], shared.data[start:end]
+            similarity = counts / (sizes[i] + sizes[columns] - counts)
+            nb_nearest = min(nb_neighbors, len(columns))
+            nearest = np.argpartition(-similarity, nb_nearest - 1)[:nb_nearest]
+
+            for j in columns[nearest].tolist():
+                partners[i].add(j)
+                partners[j].add(i)
+
+        _, neighbors = nearest_neighbors(warehouse, nb_neighbors)
+        nb_partners = min(nb_neighbors, len(partners) - 1)
+
+        for i, row in enumerate(neighbors.tolist()):
+            for j in row:
+                if len(partners[i]) >= nb_partners:
+                    break
+
+                if j != i:
+                    partners[i].add(j)
+                    partners[j].add(i)
+
+        return sorted(
+            set((min(i, j), max(i, j)) for i, row in enumerate(partners) for j in row)
+        )
+
+
+class AisleJaccard(PositionJaccard):
+    """
+    # Aisle Jaccard distance
+
+    Jaccard distance between the sets of aisles visited by two orders, from the aisle subdivision of the warehouse.
+    Two orders in the same aisles share most of their route, even if they do not share any position.
+    """
+
+    def get_incidence(self, warehouse: Warehouse) -> csr_matrix:
+        """Sparse binary matrix of the aisles (columns) visited by each order (rows), ignoring the positions outside the aisles."""
+        if warehouse.aisles is None:
+            raise ValueError(
+                "The AisleJaccard closeness metric requires the aisle subdivision of the warehouse"
+            )
+
+        positions = super().get_incidence(warehouse).tocoo()
+        aisles = warehouse.aisles.aisle[positions.col]
+        mask = aisles >= 0
+        incidence = csr_matrix(
+            (positions.data[mask], (positions.row[mask], aisles[mask])),
+            shape=(warehouse.nb_orders, warehouse.aisles.nb_aisles),
+        )
+        incidence.data[:] = 1
+
+        return incidence
+
+
+def order_centroids(warehouse: Warehouse) -> np.ndarray:
+    """Centroid of the pick-up items of each order."""
+    return np.array(
+        [
+            np.mean([item.coordinates for item in order.pickups], axis=0)
+            for order in warehouse.orders
+        ]
+    )
+
+
+def classical_mds(matrix: np.ndarray, nb_dimensions: int) -> np.ndarray:
+    """
+    Classical (Torgerson) multidimensional scaling: coordinates of the orders whose euclidean distances approximate the distance matrix.
+    The top eigenvectors of the double-centered squared distances are computed with Lanczos iterations, in O(n²) per iteration.
+    """
+    squared = np.square(matrix, dtype=float)
+    means = squared.mean(axis=1)
+    gram = -0.5 * (squared - means[:, None] - means[None, :] + means.mean())
+    nb_dimensions = min(nb_dimensions, len(matrix) - 1)
+
+    if nb_dimensions < 1:
+        return np.zeros((len(matrix), 1))
+
+    if nb_dimensions < len(matrix) - 1:
+        values, vectors = eigsh(
+            gram, k=nb_dimensions, which="LA", v0=np.ones(len(matrix))
+        )
+    else:
+        values, vectors = eigh(gram)
+        values, vectors = values[-nb_dimensions:], vectors[:, -nb_dimensions:]
+
+    return vectors * np.sqrt(np.maximum(values, 0))
+
+
+def nearest_neighbors(
+    warehouse: Warehouse, nb_neighbors: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Distances and indices of the `nb_neighbors` nearest orders of each order (including itself).
+    The neighbors are queried with a KD-tree over the centroids of the pick-up items of the orders.
+    """
+    centroids = order_centroids(warehouse)
+    nb_neighbors = min(nb_neighbors, len(centroids) - 1)
+    distances, neighbors = cKDTree(centroids).query(centroids, k=nb_neighbors + 1)
+
+    return distances.reshape(len(centroids), -1), neighbors.reshape(len(centroids), -1)
+
+
+def nearest_pairs(warehouse: Warehouse, nb_neighbors: int) -> list[tuple[int, int]]:
+    """Pairs of orders (i < j) where one order is among the `nb_neighbors` nearest orders of the other."""
+    _, neighbors = nearest_neighbors(warehouse, nb_neighbors)
+    pairs = set(
+        (min(i, j), max(i, j))
+        for i, row in enumerate(neighbors.tolist())
+        for j in row
+        if i != j
+    )
+
+    return sorted(pairs)
+
+
+CLOSENESS_METRIC_DEFAULT = "NetworkHausdorff"
+CLOSENESS_METRICS = {
+    "Hausdorff": Hausdorff,
+    "NetworkHausdorff": NetworkHausdorff,
+    "PositionJaccard": PositionJaccard,
+    "AisleJaccard": AisleJaccard,
+}
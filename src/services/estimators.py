@@ -0,0 +1,129 @@
+import numpy as np
+
+from domain.models.instances import Warehouse
+
+
+class RouteEstimator:
+    """
+    # Route length estimator
+
+    Closed-form estimation of the length of a picking route through a set of positions, based on the aisle subdivision of the warehouse.
+    The route starts and ends at the depots, which are connected to the front cross aisle.
+    The travel within the aisles depends on the routing policy, whereas the travel along the cross aisles spans from the leftmost to the rightmost visited aisle (and the depots).
+    """
+
+    def __init__(self, warehouse: Warehouse):
+        assert warehouse.aisles is not None, "Aisle subdivision not available"
+        self.aisles = warehouse.aisles
+        self.depots = np.array(warehouse.depot_ids)
+        self.direct = warehouse.distances.matrix[self.depots[0], self.depots[-1]]
+
+    def within_aisles(self, aisle: np.ndarray, depth: np.ndarray) -> float:
+        """Travel within the visited aisles, given the aisle and the depth (from the front) of each position."""
+        raise NotImplementedError
+
+    def estimate(self, positions: list[int]) -> float:
+        """Estimated route length through the positions (ids), in O(items)."""
+        aisles = self.aisles
+        positions = np.asarray(positions, dtype=int)
+        aisle = aisles.aisle[positions]
+        positions, aisle = positions[aisle >= 0], aisle[aisle >= 0]
+
+        if len(positions) == 0:
+            return self.direct
+
+        depth = aisles.y[positions] - aisles.front[aisle]
+        centers = np.concatenate([aisles.center[aisle], aisles.x[self.depots]])
+        front = aisles.front[aisle].min()
+        cross_aisle = 2 * (centers.max() - centers.min())
+        depots = np.abs(aisles.y[self.depots] - front).sum()
+
+        return self.within_aisles(aisle, depth) + cross_aisle + depots
+
+
+class SShape(RouteEstimator):
+    """
+    # S-shape policy
+
+    Each visited aisle is traversed entirely. If the number of visited aisles is odd,
+    the picker returns from the farthest pick of the last (rightmost) aisle.
+    """
+
+    def within_aisles(self, aisle: np.ndarray, depth: np.ndarray) -> float:
+        visited = np.unique(aisle)
+        lengths = self.aisles.lengths[visited]
+
+        if len(visited) % 2 == 0:
+            return lengths.sum()
+
+        last = visited[np.argmax(self.aisles.center[visited])]
+        last_depth = depth[aisle == last].max()
+
+        return lengths.sum() - self.aisles.lengths[last] + 2 * last_depth
+
+
+class LargestGap(RouteEstimator):
+    """
+    # Largest gap policy
+
+    The leftmost and rightmost visited aisles are traversed entirely, and the back cross aisle connects them.
+    The other aisles are entered from the front and the back cross aisles, up to the largest gap between adjacent picks,
+    which is never traversed. A single visited aisle is entered and left from the front.
+    """
+
+    def within_aisles(self, aisle: np.ndarray, depth: np.ndarray) -> float:
+        order = np.lexsort((depth, aisle))
+        aisle, depth = aisle[order], depth[order]
+        starts = np.flatnonzero(np.r_[True, aisle[1:] != aisle[:-1]])
+        ends = np.r_[starts[1:], len(aisle)] - 1
+        visited = aisle[starts]
+
+        if len(visited) == 1:
+            return 2 * depth[-1]
+
+        lengths = self.aisles.lengths[visited]
+        gaps = np.r_[np.diff(depth), 0]
+        gaps[ends] = 0
+        largest = np.maximum.reduceat(gaps, starts)
+        largest = np.maximum(largest, np.maximum(depth[starts], lengths - depth[ends]))
+
+        centers = self.aisles.center[visited]
+        outer = np.isin(
+            np.arange(len(visited)), [np.argmin(centers), np.argmax(centers)]
+        )
+
+        return lengths[outer].sum() + 2 * (lengths[~outer] - largest[~outer]).sum()
+
+
+class NearestNeighbor(RouteEstimator):
+    """
+    # Nearest neighbor route
+
+    Length of the nearest neighbor route over the walking distances, from the start depot to the end depot.
+    It does not require the aisle subdivision, but it runs in O(items²).
+    """
+
+    def __init__(self, warehouse: Warehouse):
+        self.matrix = warehouse.distances.matrix
+        self.depots = np.array(warehouse.depot_ids)
+
+    def estimate(self, positions: list[int]) -> float:
+        current, pending, length = self.depots[0], list(set(positions)), 0
+
+        while pending:
+            distances = self.matrix[current, pending]
+            nearest = int(np.argmin(distances))
+            length += distances[nearest]
+            current = pending.pop(nearest)
+
+        return length + self.matrix[current, self.depots[-1]]
+
+
+ROUTE_ESTIMATOR_DEFAULT = "LargestGap"
+# Route estimator used if the aisle subdivision is not available
+ROUTE_ESTIMATOR_FALLBACK = "NearestNeighbor"
+ROUTE_ESTIMATORS = {
+    "SShape": SShape,
+    "LargestGap": LargestGap,
+    "NearestNeighbor": NearestNeighbor,
+}
@@ -4,6 +4,7 @@ import numpy as np
 from pydantic import BaseModel
 
 from domain.models.instances import (
+    Aisles,
     Capacity,
     Distances,
     Item,
@@ -84,6 +85,33 @@ class Reader(IO):
 
         return orders
 
+    def build_aisles(self, aisles: str, positions: str) -> Aisles:
+        """
+        Parse the aisle subdivision (one line per aisle with the ids of its positions) to an Aisles object.
+        The geometry of each aisle is derived from the coordinates of its positions.
+        """
+        coordinates = np.array(
+            [line.split() for line in self.split(positions) if line.strip()],
+            dtype=float,
+        )
+        aisle = np.full(len(coordinates), -1)
+        lines = [line.split() for line in self.split(aisles) if line.strip()]
+
+        for idx, position_ids in enumerate(lines):
+            aisle[np.array(position_ids, dtype=int)] = idx
+
+        x, y = coordinates[:, 0], coordinates[:, 1]
+        members = [aisle == idx for idx in range(len(lines))]
+
+        return Aisles(
+            aisle=aisle,
+            x=x,
+            y=y,
+            center=np.array([x[mask].mean() for mask in members]),
+            front=np.array([y[mask].min() for mask in members]),
+            back=np.array([y[mask].max() for mask in members]),
+        )
+
     def build_vehicle(self, string: str) -> Vehicle:
         """Parse the vehicle constraints from the string to a Vehicle object."""
         max_nb_orders, max_volume = string.strip().split(" ")
@@ -98,11 +126,20 @@ class Reader(IO):
         orders = self.build_orders(self.read("supportList"), self.read("positionList"))
         vehicle = self.read("constraints")
 
+        try:
+            aisles = self.build_aisles(
+                self.read("aisleSubdivision"), self.read("positionList")
+            )
+
+        except FileNotFoundError:
+            aisles = None
+
         return Warehouse(
             instance_name=self.instance_name,
             distances=distance_matrix,
             orders=orders,
             vehicle=self.build_vehicle(vehicle),
+            aisles=aisles,
         )
 
     def load_solution(self, orders: list[Order]) -> list[list[Item]]: